@@ -10,6 +10,55 @@ from flask import request
 from typing import List, TypeVar
 
 
+class PathMatcher:
+    """
+    Excluded paths compiled once into an exact set and a prefix trie.
+
+    Paths ending with * match every path starting with the rest of it,
+    the others match exactly. Trailing slashes are ignored.
+    """
+
+    def __init__(self, excluded_paths: List[str]):
+        """
+        Compile excluded_paths.
+        """
+        self.excluded_paths = list(excluded_paths)
+        self.exact = set()
+        # char -> child node, "" marks the end of a wildcard prefix
+        self.trie = {}
+        for excluded_path in self.excluded_paths:
+            if excluded_path.endswith("*"):
+                node = self.trie
+                for char in excluded_path.rstrip("*"):
+                    node = node.setdefault(char, {})
+                node[""] = True
+            else:
+                self.exact.add(excluded_path.rstrip("/"))
+
+    def __len__(self) -> int:
+        """
+        Number of excluded paths.
+        """
+        return len(self.excluded_paths)
+
+    def match(self, path: str) -> bool:
+        """
+        Returns True if path is excluded, in O(len(path)).
+        """
+        path = path.rstrip("/")
+        if path in self.exact:
+            return True
+
+        node = self.trie
+        for char in path:
+            if "" in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return "" in node
+
+
 class Auth:
     """
     Define authentication class.
@@ -19,24 +68,18 @@ class Auth:
         """
         Returns True if path or excluded_paths is None
         and False if path in excluded_paths.
+
+        excluded_paths may be a list or an already compiled PathMatcher.
         """
         if path is None:
             return True
         if excluded_paths is None or len(excluded_paths) == 0:
             return True
 
-        # Making the paths slash tolerant
-        path = path.rstrip("/")
-
-        for excluded_path in excluded_paths:
-            if excluded_path.endswith("*"):
-                excluded_path_prefix = excluded_path.rstrip("*")
-                if path.startswith(excluded_path_prefix):
-                    return False
-            elif path == excluded_path:
-                return False
+        if not isinstance(excluded_paths, PathMatcher):
+            excluded_paths = PathMatcher(excluded_paths)
 
-        return True
+        return not excluded_paths.match(path)
 
     def authorization_header(self, request=None) -> str:
         """
@@ -2,18 +2,147 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
+from os import getenv
+import hashlib
+import json
+import uuid
+
+
+PAGE_SIZE = int(getenv("USERS_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = 1000
+# Makes collection ETags differ between processes, whose generation
+# counters are unrelated
+ETAG_SALT = str(uuid.uuid4())
+
+
+def user_etag(user: User) -> str:
+    """
+    Strong ETag of a user, from its JSON encoding: updated_at
+    alone can't tell apart two updates within the second it is
+    stored with.
+    """
+    version = user.id.encode() + b"|" + user.to_json_bytes()
+    return hashlib.sha1(version).hexdigest()
+
+
+def users_etag() -> str:
+    """
+    Strong ETag of a users listing, from the User generation
+    and the query string.
+    """
+    version = "{}|{}|".format(ETAG_SALT, User.generation()).encode()
+    return hashlib.sha1(version + request.query_string).hexdigest()
+
+
+def not_modified(etag: str) -> Response:
+    """
+    304 response if the client already has etag, None otherwise.
+    """
+    if etag not in request.if_none_match:
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def users_response(users: list, cache: bool = True) -> Response:
+    """
+    JSON list of users spliced from their cached encodings,
+    the same body jsonify() would build. Encodings missing from
+    the cache are only added to it if cache is True.
+    """
+    body = b"[" + b",".join(
+        user.to_json_bytes(cache) for user in users) + b"]\n"
+    return Response(body, mimetype="application/json")
 
 
 @app_views.route("/users", methods=["GET"], strict_slashes=False)
 def view_all_users() -> str:
     """GET /api/v1/users
+    Query parameters:
+      - limit (optional): page size, up to 1000
+      - cursor (optional): X-Next-Cursor of the previous page
+      - all (optional): "true" to list every User at once
+      - email_prefix (optional): only list the Users whose email starts
+        with it, ignoring case, sorted by email (the first limit of them)
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, in creation order
+      - X-Next-Cursor header if there are more pages
+      - 304 if If-None-Match has the listing's ETag
+      - 400 if limit or cursor is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    etag = users_etag()
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    email_prefix = request.args.get("email_prefix")
+    if request.args.get("all") == "true":
+        if email_prefix is not None:
+            users = User.search_prefix("email", email_prefix)
+        else:
+            users = User.all()
+        # Would push every other user out of the cache
+        response = users_response(users, cache=False)
+        response.set_etag(etag)
+        return response
+
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({"error": "Wrong limit"}), 400
+    if email_prefix is not None:
+        users = User.search_prefix(
+            "email", email_prefix, min(limit, MAX_PAGE_SIZE))
+        response = users_response(users)
+        response.set_etag(etag)
+        return response
+    try:
+        users, next_cursor = User.page(
+            min(limit, MAX_PAGE_SIZE), request.args.get("cursor"))
+    except ValueError:
+        return jsonify({"error": "Wrong cursor"}), 400
+
+    response = users_response(users)
+    response.set_etag(etag)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@app_views.route("/users/export", methods=["GET"], strict_slashes=False)
+def export_users() -> str:
+    """GET /api/v1/users/export
+    Query parameters:
+      - fields (optional): comma separated attributes to export
+    Return:
+      - every User JSON represented, one per line (NDJSON), streamed
+        page by page so memory use doesn't grow with the user count
+    """
+    fields = None
+    if request.args.get("fields"):
+        fields = [f for f in request.args.get("fields").split(",") if f]
+
+    def generate():
+        cursor = None
+        while True:
+            users, cursor = User.page(MAX_PAGE_SIZE, cursor)
+            lines = []
+            for user in users:
+                user_json = user.to_json()
+                if fields is not None:
+                    user_json = {k: user_json[k]
+                                 for k in fields if k in user_json}
+                lines.append(json.dumps(user_json) + "\n")
+            yield "".join(lines)
+            if cursor is None:
+                return
+
+    return Response(generate(), mimetype="application/x-ndjson")
 
 
 @app_views.route("/users/<user_id>", methods=["GET"], strict_slashes=False)
@@ -23,6 +152,7 @@ def view_one_user(user_id: str = None) -> str:
       - User ID
     Return:
       - User object JSON represented
+      - 304 if If-None-Match has the User's ETag
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -30,7 +160,13 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    etag = user_etag(user)
+    response = not_modified(etag)
+    if response is None:
+        response = Response(
+            user.to_json_bytes() + b"\n", mimetype="application/json")
+        response.set_etag(etag)
+    return response
 
 
 @app_views.route("/users/<user_id>", methods=["DELETE"], strict_slashes=False)
@@ -89,6 +225,61 @@ def create_user() -> str:
     return jsonify({"error": error_msg}), 400
 
 
+@app_views.route("/users/import", methods=["POST"], strict_slashes=False)
+def import_users() -> str:
+    """POST /api/v1/users/import
+    Body:
+      - JSON list or NDJSON of users, each with the attributes of
+        POST /api/v1/users
+    Return:
+      - number of created Users and one result per record, in order:
+        the new User ID or the error ("Wrong format" for NDJSON lines
+        that can't be parsed)
+    """
+    body = request.get_data(as_text=True)
+    try:
+        records = json.loads(body)
+        if not isinstance(records, list):
+            records = [records]
+    except ValueError:
+        records = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Not a dict, reported as "Wrong format" below
+                records.append(None)
+
+    users = []
+    results = []
+    for rj in records:
+        error_msg = None
+        if not isinstance(rj, dict):
+            error_msg = "Wrong format"
+        elif rj.get("email", "") == "":
+            error_msg = "email missing"
+        elif rj.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is None:
+            try:
+                user = User()
+                user.email = rj.get("email")
+                user.password = rj.get("password")
+                user.first_name = rj.get("first_name")
+                user.last_name = rj.get("last_name")
+                users.append(user)
+                results.append({"id": user.id})
+                continue
+            except Exception as e:
+                error_msg = "Can't create User: {}".format(e)
+        results.append({"error": error_msg})
+
+    User.save_all(users)
+    return jsonify({"created": len(users), "results": results}), 200
+
+
 @app_views.route("/users/<user_id>", methods=["PUT"], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """PUT /api/v1/users/:id
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point loading the store once, before workers are forked:
+
+    gunicorn --preload -w 4 api.v1.wsgi:app
+
+The master process imports this module, so every worker shares the
+loaded users copy-on-write instead of parsing the files again
+"""
+from api.v1.app import app  # noqa: F401
+from models.base import freeze
+
+
+# Importing the app loaded the store: keep the garbage collector from
+# touching it in the workers
+freeze()
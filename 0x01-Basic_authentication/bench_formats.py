@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Save time, load time and file size of the snapshot formats:
+
+    ./bench_formats.py [users]
+
+Works on generated users in a temporary directory. Load times are for
+parsing the records, one at a time like eager loading does, and all at
+once for JSON like lazy loading does. The mapped format is not read:
+its load time is that of mapping the file and reading its indexes
+"""
+import os
+import sys
+import tempfile
+import time
+from models.base import BinaryCodec, JSONCodec, MappedCodec, write_atomic
+from models.user import User
+
+
+def users(count: int) -> list:
+    """count users with every attribute set"""
+    result = []
+    for i in range(count):
+        user = User()
+        user.email = "user{}@example.com".format(i)
+        user.password = "pwd{}".format(i)
+        user.first_name = "First{}".format(i)
+        user.last_name = "Last{}".format(i)
+        result.append(user)
+    return result
+
+
+def bench(name: str, codec: object, objs: list, directory: str):
+    """Print the save time, size and load times of codec on objs"""
+    file_path = os.path.join(directory, "users." + codec.extension)
+    start = time.perf_counter()
+    write_atomic(file_path, ((obj.id, obj.to_json(True)) for obj in objs),
+                 codec, User.indexed_attributes)
+    save = time.perf_counter() - start
+
+    loads = []
+    for stream in (True, False):
+        if isinstance(codec, MappedCodec):
+            start = time.perf_counter()
+            with open(file_path, "rb") as f:
+                codec.map(f)
+            loads.append(time.perf_counter() - start)
+            break
+        if isinstance(codec, BinaryCodec) and not stream:
+            # Always streams
+            break
+        start = time.perf_counter()
+        with open(file_path, "r" + codec.mode) as f:
+            for _ in codec.load(f, stream):
+                pass
+        loads.append(time.perf_counter() - start)
+
+    print("{:<18} {:>8.2f} {:>10.2f} {:>10} {:>10.1f}".format(
+        name, save, loads[0],
+        "{:.2f}".format(loads[1]) if len(loads) > 1 else "-",
+        os.path.getsize(file_path) / 1e6))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    objs = users(count)
+    print("{} users".format(count))
+    print("{:<18} {:>8} {:>10} {:>10} {:>10}".format(
+        "format", "save s", "stream s", "at once s", "size MB"))
+    with tempfile.TemporaryDirectory() as directory:
+        bench("json", JSONCodec(), objs, directory)
+        bench("binary", BinaryCodec(), objs, directory)
+        bench("binary compressed", BinaryCodec(compress=True), objs,
+              directory)
+        bench("mapped", MappedCodec(), objs, directory)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Time of searches on attributes without a HashIndex, filtering the
+objects one by one and comparing the columns of a ColumnIndex
+(DB_COLUMNS=1):
+
+    ./bench_search.py [users]
+
+Works on generated users saved in a temporary directory, with the
+search() result cache disabled
+"""
+import os
+import sys
+import tempfile
+import time
+from models import base
+from models.base import ColumnIndex
+from models.user import User
+
+
+def users(count: int) -> list:
+    """count users sharing 100 first names and 1000 last names"""
+    result = []
+    for i in range(count):
+        user = User()
+        user.email = "user{}@example.com".format(i)
+        user.password = "pwd{}".format(i)
+        user.first_name = "First{}".format(i % 100)
+        user.last_name = "Last{}".format(i % 1000)
+        result.append(user)
+    return result
+
+
+def timed(attributes: dict, runs: int = 5) -> tuple:
+    """Number of results and best time in ms of searching attributes"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        results = User.search(attributes)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(results), best * 1000
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    base.SEARCH_CACHE_SIZE = 0
+    queries = (
+        {"first_name": "First7"},
+        {"first_name": "First7", "last_name": "Last107"},
+        {"first_name": "First7", "last_name": "Last8"},
+        {"last_name": "Last107", "first_name": "First7", "_password": None},
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        User.save_all(users(count))
+        print("{} users".format(count))
+        print("{:<60} {:>7} {:>10} {:>10}".format(
+            "attributes", "results", "filter ms", "columns ms"))
+        for attributes in queries:
+            base.COLUMNS.pop("User", None)
+            results, filtered = timed(attributes)
+            base.COLUMNS["User"] = ColumnIndex(
+                User.column_attributes(), base.DATA["User"].values())
+            columns_results, columns = timed(attributes)
+            assert columns_results == results
+            print("{:<60} {:>7} {:>10.2f} {:>10.2f}".format(
+                ", ".join("{}={}".format(k, v)
+                          for k, v in attributes.items()),
+                results, filtered, columns))
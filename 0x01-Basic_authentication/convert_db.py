@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Convert a snapshot between the JSON and the binary formats:
+
+    ./convert_db.py .db_User.json .db_User.bin [--compress | --mapped]
+
+The format of each file comes from its extension, --mapped writes the
+binary file sorted and indexed for DB_FORMAT=mapped. Journals don't
+depend on the format: start the API with DB_FORMAT=binary (and
+DB_COMPRESS=1 with --compress) or DB_FORMAT=mapped once the snapshot is
+converted
+"""
+import sys
+from models.base import CODECS, MappedCodec, write_atomic
+from models.user import User
+
+
+def codec_for(file_path: str, compress: bool = False) -> object:
+    """Codec of the format file_path's extension names"""
+    for codec in CODECS.values():
+        if codec is MappedCodec:
+            # Same extension as the binary format, which reads it
+            continue
+        if file_path.endswith("." + codec.extension):
+            if codec.extension == "json":
+                return codec()
+            return codec(compress=compress)
+    raise ValueError("Unknown format: {}".format(file_path))
+
+
+def convert(src_path: str, dst_path: str, compress: bool = False,
+            mapped: bool = False) -> int:
+    """Write the records of src_path to dst_path, return their number"""
+    src = codec_for(src_path)
+    dst = codec_for(dst_path, compress)
+    if mapped:
+        if dst.extension != MappedCodec.extension:
+            raise ValueError("--mapped writes .{} files".format(
+                MappedCodec.extension))
+        dst = MappedCodec(compress=compress)
+    count = 0
+
+    def records(f):
+        nonlocal count
+        for obj_id, obj_json in src.load(f):
+            count += 1
+            yield obj_id, obj_json
+
+    with open(src_path, "r" + src.mode) as f:
+        write_atomic(dst_path, records(f), dst, User.indexed_attributes)
+    return count
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:]
+            if arg not in ("--compress", "--mapped")]
+    if len(args) != 2:
+        sys.exit("usage: {} SOURCE DESTINATION [--compress | --mapped]"
+                 .format(sys.argv[0]))
+    try:
+        count = convert(args[0], args[1], "--compress" in sys.argv,
+                        "--mapped" in sys.argv)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("{} records written to {}".format(count, args[1]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Memory used by each of several forked workers serving the store, with
+the store loaded per worker, preloaded before fork, or preloaded and
+frozen (what api/v1/wsgi.py does):
+
+    ./measure_rss.py [workers] [per-worker|preload|freeze]
+
+Reads /proc/<pid>/smaps_rollup, so Linux only. Private memory is the
+part a worker doesn't share with the others: what each extra worker
+costs
+"""
+import gc
+import os
+import sys
+import time
+from models.base import freeze
+from models.user import User
+
+
+MODES = ("per-worker", "preload", "freeze")
+
+
+def memory() -> dict:
+    """Rss, Pss and private memory of this process, in kB"""
+    stats = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                stats[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": stats["Rss"],
+        "pss": stats["Pss"],
+        "private": stats["Private_Clean"] + stats["Private_Dirty"],
+    }
+
+
+def work():
+    """Read the store like requests do"""
+    users = User.all()
+    for user in users[:1000]:
+        User.get(user.id)
+        User.search({"email": user.email})
+        user.to_json()
+    # Long running workers eventually run full collections
+    gc.collect()
+
+
+def worker(mode: str, fd: int):
+    """Serve the workload, then report memory use through fd"""
+    if mode == "per-worker":
+        User.load_from_file()
+    work()
+    stats = memory()
+    os.write(fd, "{rss} {pss} {private}\n".format(**stats).encode())
+
+
+def measure(workers: int, mode: str) -> list:
+    """Memory use of each worker in mode"""
+    if mode != "per-worker":
+        User.load_from_file()
+    if mode == "freeze":
+        freeze()
+
+    r, w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            worker(mode, w)
+            # Stay alive until every worker measured, so the pages
+            # they share are counted as shared
+            time.sleep(1 + workers * 0.1)
+            os._exit(0)
+        pids.append(pid)
+    os.close(w)
+
+    with os.fdopen(r, "r") as f:
+        results = [tuple(map(int, line.split())) for line in f]
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return results
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    mode = sys.argv[2] if len(sys.argv) > 2 else "freeze"
+    if mode not in MODES:
+        sys.exit("mode must be one of: {}".format(", ".join(MODES)))
+
+    results = measure(workers, mode)
+    print("{} workers, {}".format(workers, mode))
+    print("{:>6} {:>10} {:>10} {:>10}".format(
+        "worker", "RSS kB", "PSS kB", "private kB"))
+    for i, (rss, pss, private) in enumerate(results):
+        print("{:>6} {:>10} {:>10} {:>10}".format(i, rss, pss, private))
+    print("{:>6} {:>10} {:>10} {:>10}".format(
+        "total", sum(r[0] for r in results), sum(r[1] for r in results),
+        sum(r[2] for r in results)))
@@ -1,37 +1,1237 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from array import array
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Tuple
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from itertools import compress, repeat
+from os import getenv, path, remove
+import atexit
+import base64
+import bisect
+import fcntl
+import gc
 import json
+import logging
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import threading
+import time
 import uuid
+import zlib
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
 
+# "file" rewrites .db_{Class}.json on every write, "journal" appends each
+# write to .db_{Class}.journal and folds it back into the snapshot once
+# it holds JOURNAL_THRESHOLD records
+STORAGE = getenv("DB_STORAGE", "file")
+# Format of the snapshot: "json" (.db_{Class}.json) or "binary"
+# (.db_{Class}.bin, see BinaryCodec), compressed if DB_COMPRESS=1, or
+# "mapped" (.db_{Class}.bin too, see MappedCodec) for stores that are
+# read far more than written: records stay in the file until read
+FORMAT = getenv("DB_FORMAT", "json")
+COMPRESS = getenv("DB_COMPRESS") == "1"
+JOURNAL_THRESHOLD = int(getenv("DB_JOURNAL_THRESHOLD", "1000"))
+JOURNAL_SIZE = {}
+# Seconds the background writer waits to group snapshot rewrites
+# together, 0 rewrites the snapshot in the saving thread
+WRITE_DELAY = float(getenv("DB_WRITE_DELAY", "0"))
+FSYNC = getenv("DB_FSYNC") == "1"
+WRITER = None
+# One lock per class for writers and one per class for snapshot
+# rewrites; readers never lock, they work on snapshots of DATA
+LOCKS = {}
+LOCKS_LOCK = threading.Lock()
+INDEXES = {}
+ORDERS = {}
+# Class -> SortedIndex of each sorted attribute, built on first use
+SORTED_INDEXES = {}
+# Keep a ColumnIndex of every class, for searches on attributes that have
+# no HashIndex
+COLUMNAR = getenv("DB_COLUMNS") == "1"
+COLUMNS = {}
+# Bumped by every write, so callers can tell whether a class changed
+GENERATIONS = {}
+# Generation of each class last written to or read from the snapshot:
+# in "file" mode, writes after it are only in memory
+SAVED = {}
+# (class, attributes, generation) -> search() results, least recently
+# used first; a write starts a new generation so entries never go stale
+SEARCH_CACHE = OrderedDict()
+SEARCH_CACHE_SIZE = int(getenv("DB_SEARCH_CACHE_SIZE", "1024"))
+# Larger results are not cached, they would pin too many objects
+SEARCH_CACHE_MAX_RESULTS = 1000
+SEARCH_STATS = {"hits": 0, "misses": 0}
+SEARCH_LOCK = threading.Lock()
+FIELDS = {}
+# (class, ID) -> (updated_at, to_json_bytes()) of the JSON_CACHE_SIZE
+# objects most recently encoded, least recently used first
+JSON_CACHE = OrderedDict()
+JSON_CACHE_SIZE = int(getenv("DB_JSON_CACHE_SIZE", "10000"))
+JSON_LOCK = threading.Lock()
+# Keep loaded records as JSON and only build objects when they are read,
+# holding on to the LAZY_CACHE_SIZE most recently used ones
+LAZY_LOAD = getenv("DB_LAZY_LOAD") == "1"
+LAZY_CACHE_SIZE = int(getenv("DB_LAZY_CACHE_SIZE", "10000"))
+# Tokens of the JSON object iter_json_object() reads
+OBJECT_START = re.compile(r"[ \t\n\r]*\{[ \t\n\r]*")
+OBJECT_KEY = re.compile(
+    r'[ \t\n\r]*"([^"\\]*(?:\\.[^"\\]*)*)"[ \t\n\r]*:[ \t\n\r]*', re.S)
+OBJECT_NEXT = re.compile(r"[ \t\n\r]*([,}])[ \t\n\r]*")
+# What may follow the start of a JSON number
+NUMBER_REST = re.compile(r"[0-9eE.+-]*")
+# Seconds between checks for writes made by other processes sharing the
+# files (gunicorn workers...), 0 disables them. Snapshot rewrites are
+# reloaded in full and journal appends replayed one by one, so several
+# processes writing at once need DB_STORAGE=journal: in "file" mode the
+# last snapshot rewrite still wins
+SYNC_INTERVAL = float(getenv("DB_SYNC_INTERVAL", "0"))
+# Class -> what this process last read of its files: snapshot identity,
+# journal inode and offset, and when they were last checked
+SYNC_STATE = {}
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a TIMESTAMP_FORMAT string, about 35x faster than strptime"""
+    if len(value) == 19 and value[10] == "T":
+        return datetime.fromisoformat(value)
+    # Raises the same errors as before on other formats
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def format_timestamp(value: datetime) -> str:
+    """Format a datetime in TIMESTAMP_FORMAT, about 3x faster than strftime
+    """
+    return value.isoformat()[:19]
+
+
+def attribute(obj, name: str):
+    """Value of name on an object or in its JSON record"""
+    if type(obj) is dict:
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class HashIndex:
+    """Equality index of one attribute: value -> set of object IDs"""
+
+    def __init__(self, attribute: str):
+        """Initialize an empty index on attribute"""
+        self.attribute = attribute
+        self.ids = {}
+        self.values = {}
+
+    def add(self, obj: TypeVar("Base")):
+        """Index obj under its current attribute value"""
+        obj_id = attribute(obj, "id")
+        self.discard(obj_id)
+        value = attribute(obj, self.attribute)
+        try:
+            self.ids.setdefault(value, set()).add(obj_id)
+        except TypeError:
+            # Unhashable value: search() will scan for it
+            return
+        self.values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """Drop obj_id from the index"""
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        ids.discard(obj_id)
+        if len(ids) == 0:
+            del self.ids[value]
+
+    def lookup(self, value) -> set:
+        """IDs of objects indexed under value"""
+        return self.ids.get(value, set())
+
+
+class OrderedIndex:
+    """Object IDs sorted by (created_at, id) for keyset pagination"""
+
+    def __init__(self, objs: Iterable = ()):
+        """Initialize the index with objs (or their JSON records)"""
+        self.by_id = {}
+        for obj in objs:
+            key = self.key(obj)
+            self.by_id[key[1]] = key
+        # Sorted once rather than inserted one by one
+        self.keys = sorted(self.by_id.values())
+
+    @staticmethod
+    def key(obj: TypeVar("Base")) -> tuple:
+        """Sort key of obj (or its JSON record)"""
+        created_at = attribute(obj, "created_at")
+        if type(created_at) is datetime:
+            created_at = format_timestamp(created_at)
+        return (created_at, attribute(obj, "id"))
+
+    def add(self, obj: TypeVar("Base")):
+        """Insert obj (or its JSON record) at its position"""
+        key = self.key(obj)
+        if self.by_id.get(key[1]) == key:
+            return
+        self.discard(key[1])
+        bisect.insort(self.keys, key)
+        self.by_id[key[1]] = key
+
+    def discard(self, obj_id: str):
+        """Drop obj_id from the index"""
+        key = self.by_id.pop(obj_id, None)
+        if key is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def after(self, key: tuple, limit: int) -> List[tuple]:
+        """Up to limit keys following key (from the start if None)"""
+        start = 0
+        if key is not None:
+            start = bisect.bisect_right(self.keys, key)
+        return self.keys[start:start + limit]
+
+
+class SortedIndex:
+    """Object IDs sorted by the lowercase value of one attribute, for
+    prefix and case-insensitive searches: (value, id) keys, bisected
+    """
+
+    def __init__(self, attribute: str, objs: Iterable = ()):
+        """Initialize the index on attribute with objs (or their JSON
+        records)
+        """
+        self.attribute = attribute
+        self.by_id = {}
+        for obj in objs:
+            key = self.key(obj)
+            if key is not None:
+                self.by_id[key[1]] = key
+        # Sorted once rather than inserted one by one
+        self.keys = sorted(self.by_id.values())
+
+    def key(self, obj: TypeVar("Base")) -> tuple:
+        """Sort key of obj (or its JSON record), None if its value isn't
+        a string
+        """
+        value = attribute(obj, self.attribute)
+        if type(value) is not str:
+            return None
+        return (value.lower(), attribute(obj, "id"))
+
+    def add(self, obj: TypeVar("Base")):
+        """Insert obj (or its JSON record) at its position"""
+        obj_id = attribute(obj, "id")
+        key = self.key(obj)
+        if self.by_id.get(obj_id) == key:
+            return
+        self.discard(obj_id)
+        if key is not None:
+            bisect.insort(self.keys, key)
+            self.by_id[obj_id] = key
+
+    def discard(self, obj_id: str):
+        """Drop obj_id from the index"""
+        key = self.by_id.pop(obj_id, None)
+        if key is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def between(self, low: str, high: str, limit: int = None) -> List[str]:
+        """IDs of the objects whose lowercase value is in [low, high),
+        up to limit of them, in order
+        """
+        start = bisect.bisect_left(self.keys, (low,))
+        end = len(self.keys)
+        if high is not None:
+            end = bisect.bisect_left(self.keys, (high,))
+        if limit is not None:
+            end = min(end, start + limit)
+        return [obj_id for _, obj_id in self.keys[start:end]]
+
+    def prefix(self, prefix: str, limit: int = None) -> List[str]:
+        """IDs of the objects whose value starts with prefix, ignoring
+        case, up to limit of them, in order
+        """
+        prefix = prefix.lower()
+        # The first string after all those starting with prefix: its
+        # last character that can be incremented, incremented. None if
+        # there's none (empty or only U+10FFFF), all strings after it
+        high = prefix.rstrip(chr(sys.maxunicode))
+        if len(high) > 0:
+            high = high[:-1] + chr(ord(high[-1]) + 1)
+        else:
+            high = None
+        return self.between(prefix, high, limit)
+
+    def lookup(self, value: str) -> List[str]:
+        """IDs of the objects whose value equals value, ignoring case"""
+        value = value.lower()
+        # Keys (value, id) sort below (value + "\0",)
+        return self.between(value, value + "\0")
+
+
+class ColumnIndex:
+    """Attribute values of all objects, one list per attribute, so that
+    equality filters compare whole columns in C rather than reading the
+    attributes of one object at a time
+
+    Position i of every column belongs to the object ids[i]. Removed
+    objects leave a hole (None ID), filled by the next added object.
+    Columns grow before ids, so positions below len(ids) exist in all.
+    """
+
+    def __init__(self, attributes: tuple, objs: Iterable = ()):
+        """Initialize the columns of attributes with objs (or their
+        JSON records)
+        """
+        self.columns = {name: [] for name in attributes}
+        self.ids = []
+        self.positions = {}
+        self.holes = []
+        for obj in objs:
+            self.add(obj)
+
+    def add(self, obj: TypeVar("Base")):
+        """Store the current attribute values of obj"""
+        obj_id = attribute(obj, "id")
+        position = self.positions.get(obj_id)
+        if position is None and len(self.holes) > 0:
+            position = self.holes.pop()
+        elif position is None:
+            position = len(self.ids)
+            for column in self.columns.values():
+                column.append(None)
+            self.ids.append(None)
+        for name, column in self.columns.items():
+            column[position] = attribute(obj, name)
+        self.ids[position] = obj_id
+        self.positions[obj_id] = position
+
+    def discard(self, obj_id: str):
+        """Drop the values of obj_id"""
+        position = self.positions.pop(obj_id, None)
+        if position is None:
+            return
+        self.ids[position] = None
+        for column in self.columns.values():
+            column[position] = None
+        self.holes.append(position)
+
+    def lookup(self, attributes: dict) -> List[str]:
+        """IDs of objects whose values equal those of attributes, which
+        must all have a column
+        Concurrent writes can add objects that don't match to the
+        results: callers check them
+        """
+        positions = None
+        for name, value in attributes.items():
+            column = self.columns[name]
+            if positions is None:
+                values = column
+                positions = range(len(self.ids))
+            else:
+                values = map(column.__getitem__, positions)
+            positions = list(compress(
+                positions, map(operator.eq, values, repeat(value))))
+        return [obj_id for obj_id in map(self.ids.__getitem__, positions)
+                if obj_id is not None]
+
+
+class LazyObjects:
+    """Objects of one class kept as JSON records, built on access
+
+    Stands in for the dict of DATA: every object has its record in
+    records, and the capacity most recently used ones are also kept
+    built in hot.
+    """
+
+    def __init__(self, cls: type, records: dict, capacity: int):
+        """Initialize the store with records: ID -> JSON record"""
+        self.cls = cls
+        self.records = records
+        self.hot = OrderedDict()
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # Number of writes, telling get() whether the record it built an
+        # object from is still current (MappedRecords decode a new one
+        # on every read, so records can't be compared)
+        self.version = 0
+
+    def _cache(self, obj_id: str, obj: TypeVar("Base")):
+        """Keep obj built, with self.lock held"""
+        self.hot[obj_id] = obj
+        self.hot.move_to_end(obj_id)
+        while len(self.hot) > self.capacity:
+            self.hot.popitem(last=False)
+
+    def peek(self, obj_id: str) -> TypeVar("Base"):
+        """Return the object without caching it, None if missing"""
+        obj = self.hot.get(obj_id)
+        if obj is not None:
+            return obj
+        record = self.records.get(obj_id)
+        if record is None:
+            return None
+        return self.cls(**record)
+
+    def get(self, obj_id: str, default=None) -> TypeVar("Base"):
+        """Return the object and keep it built"""
+        with self.lock:
+            obj = self.hot.get(obj_id)
+            if obj is not None:
+                self.hot.move_to_end(obj_id)
+                return obj
+            record = self.records.get(obj_id)
+            version = self.version
+        if record is None:
+            return default
+        obj = self.cls(**record)
+        with self.lock:
+            if self.version == version:
+                self._cache(obj_id, obj)
+        return obj
+
+    def __getitem__(self, obj_id: str) -> TypeVar("Base"):
+        """Return the object, KeyError if missing"""
+        obj = self.get(obj_id)
+        if obj is None:
+            raise KeyError(obj_id)
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar("Base")):
+        """Store obj"""
+        record = obj.to_json(True)
+        with self.lock:
+            self.records[obj_id] = record
+            self._cache(obj_id, obj)
+            self.version += 1
+
+    def put(self, obj_id: str, record: dict):
+        """Store an object as its JSON record, built on next access"""
+        with self.lock:
+            self.records[obj_id] = record
+            self.hot.pop(obj_id, None)
+            self.version += 1
+
+    def __delitem__(self, obj_id: str):
+        """Remove an object, KeyError if missing"""
+        with self.lock:
+            del self.records[obj_id]
+            self.hot.pop(obj_id, None)
+            self.version += 1
+
+    def __contains__(self, obj_id: str) -> bool:
+        """Whether obj_id is stored"""
+        return obj_id in self.records
+
+    def __len__(self) -> int:
+        """Number of objects"""
+        return len(self.records)
+
+    def keys(self) -> Iterable[str]:
+        """IDs of the objects"""
+        return self.records.keys()
+
+    def values(self) -> Iterable[TypeVar("Base")]:
+        """Iterate over a snapshot of the objects, without caching them"""
+        # Records are never modified, only replaced
+        for obj_id, record in self.records.copy().items():
+            obj = self.hot.get(obj_id)
+            yield obj if obj is not None else self.cls(**record)
+
+    def items(self) -> Iterable[tuple]:
+        """Iterate over (ID, object) pairs, like values()"""
+        for obj in self.values():
+            yield obj.id, obj
+
+
+def lock_for(name: str) -> threading.RLock:
+    """Return the lock named name, creating it on first use"""
+    lock = LOCKS.get(name)
+    if lock is None:
+        with LOCKS_LOCK:
+            lock = LOCKS.setdefault(name, threading.RLock())
+    return lock
+
+
+def file_identity(file_path: str) -> tuple:
+    """(inode, size, mtime) of file_path, None if it doesn't exist"""
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def iter_json_object(f, chunk_size: int = 1 << 16) -> Iterable[tuple]:
+    """Yield the (key, value) pairs of the JSON object in file f one at
+    a time, holding a chunk of the file and a value rather than the
+    whole object
+    """
+    scan = json.JSONDecoder().scan_once
+    buf = ""
+    pos = 0
+    eof = False
+    read_size = chunk_size
+    # What comes next: the opening "{", a "key" and its value, or the
+    # "next" "," or "}"
+    step = "{"
+    while True:
+        try:
+            if step == "{":
+                match = OBJECT_START.match(buf, pos)
+                if match is None or match.end() == len(buf):
+                    raise IndexError
+                pos = match.end()
+                step = "key"
+                if buf[pos] == "}":
+                    return
+            elif step == "key":
+                match = OBJECT_KEY.match(buf, pos)
+                if match is None or match.end() == len(buf):
+                    raise IndexError
+                key = match.group(1)
+                if "\\" in key:
+                    key = json.loads('"{}"'.format(key))
+                value, end = scan(buf, match.end())
+                if type(value) in (int, float) and \
+                        NUMBER_REST.match(buf, end).end() == len(buf):
+                    # The number may go on in the next chunk
+                    raise IndexError
+                pos = end
+                step = "next"
+                yield key, value
+            else:
+                match = OBJECT_NEXT.match(buf, pos)
+                if match is None:
+                    raise IndexError
+                pos = match.end()
+                if match.group(1) == "}":
+                    return
+                step = "key"
+            read_size = chunk_size
+        except (IndexError, StopIteration, ValueError):
+            # Cut by the end of the chunk: parse it again with more,
+            # reading ever larger chunks so that an invalid file doesn't
+            # get read again and again
+            if eof:
+                raise ValueError("Invalid JSON object")
+            chunk = f.read(read_size)
+            eof = len(chunk) == 0
+            buf = buf[pos:] + chunk
+            pos = 0
+            read_size *= 2
+
+
+class JSONCodec:
+    """Snapshot as one JSON object: ID -> JSON record"""
+
+    extension = "json"
+    # Files are opened in text mode
+    mode = ""
+
+    def __init__(self, compress: bool = False):
+        """Initialize the codec"""
+        if compress:
+            raise ValueError("Only the binary format can be compressed")
+
+    def load(self, f, stream: bool = True) -> Iterable[tuple]:
+        """Read the (ID, JSON record) pairs of file f, parsed one at a
+        time if stream, all at once otherwise (faster, but they are all
+        held until the last one is read)
+        """
+        if stream:
+            return iter_json_object(f)
+        return json.load(f).items()
+
+    def dump(self, f, objs_json: Iterable[tuple],
+             indexed_attributes: tuple = ()):
+        """Write the (ID, JSON record) pairs of objs_json to file f
+        (only MappedCodec indexes indexed_attributes)
+        """
+        f.write("{")
+        separator = ""
+        for obj_id, obj_json in objs_json:
+            f.write("{}{}: {}".format(
+                separator, json.dumps(obj_id), json.dumps(obj_json)))
+            separator = ", "
+        f.write("}")
+
+
+class BinaryCodec:
+    """Snapshot as a sequence of length-prefixed records
+
+    The file starts with MAGIC and a flags byte, followed by frames: a
+    FRAME header (lengths of the ID and of the payload, key set), the
+    ID and the payload. Records only hold their values, as a JSON list,
+    and refer to a key set frame listing their keys, written before the
+    first record having them. With compress, everything after the flags
+    is one zlib stream.
+    """
+
+    extension = "bin"
+    # Files are opened in binary mode
+    mode = "b"
+    MAGIC = b"DBB1"
+    COMPRESSED = 1
+    FRAME = struct.Struct(">HIH")
+    # Key set of the frames defining key sets
+    KEYS = 0xFFFF
+    # Key sets of the frames of MappedCodec's indexes, skipped here:
+    # those of records are below TRAILER
+    INDEX = 0xFFFE
+    VALUES = 0xFFFD
+    TRAILER = 0xFFFC
+    encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def __init__(self, compress: bool = False):
+        """Initialize the codec"""
+        self.compress = compress
+
+    def load(self, f, stream: bool = True) -> Iterable[tuple]:
+        """Read the (ID, JSON record) pairs of file f, one at a time
+        whatever stream is
+        """
+        header = f.read(len(self.MAGIC) + 1)
+        if header[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Not a binary snapshot")
+        decompressor = None
+        if header[-1] & self.COMPRESSED:
+            decompressor = zlib.decompressobj()
+        scan = json.JSONDecoder().scan_once
+        key_sets = []
+        buf = b""
+        # buf decoded byte for byte: payloads are ASCII, so the JSON
+        # scanner reads them in place
+        text = ""
+        pos = 0
+        eof = False
+        while True:
+            start = pos + self.FRAME.size
+            if start <= len(buf):
+                id_length, length, key_set = self.FRAME.unpack_from(buf, pos)
+                end = start + id_length + length
+                if end <= len(buf):
+                    if key_set == self.KEYS:
+                        key_sets.append(scan(text, start)[0])
+                    elif key_set < self.TRAILER:
+                        values, _ = scan(text, start + id_length)
+                        obj_id = buf[start:start + id_length].decode()
+                        yield obj_id, dict(zip(key_sets[key_set], values))
+                    pos = end
+                    continue
+            if eof:
+                if pos < len(buf) or \
+                        decompressor is not None and not decompressor.eof:
+                    raise ValueError("Truncated binary snapshot")
+                return
+            chunk = f.read(1 << 16)
+            eof = len(chunk) == 0
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk) if not eof \
+                    else decompressor.flush()
+            buf = buf[pos:] + chunk
+            text = buf.decode("latin-1")
+            pos = 0
+
+    def dump(self, f, objs_json: Iterable[tuple],
+             indexed_attributes: tuple = ()):
+        """Write the (ID, JSON record) pairs of objs_json to file f
+        (only MappedCodec indexes indexed_attributes)
+        """
+        f.write(self.MAGIC + bytes([self.COMPRESSED if self.compress else 0]))
+        # The fastest level: nearly as small as the default one on user
+        # records, and twice as fast
+        compressor = zlib.compressobj(1) if self.compress else None
+        key_sets = {}
+        for obj_id, obj_json in objs_json:
+            frames = b""
+            keys = tuple(obj_json)
+            key_set = key_sets.get(keys)
+            if key_set is None:
+                key_set = key_sets[keys] = len(key_sets)
+                payload = self.encode(keys).encode()
+                frames = self.FRAME.pack(0, len(payload), self.KEYS) + payload
+            id_bytes = obj_id.encode()
+            payload = self.encode(list(obj_json.values())).encode()
+            frames += self.FRAME.pack(len(id_bytes), len(payload), key_set) \
+                + id_bytes + payload
+            if compressor is not None:
+                frames = compressor.compress(frames)
+            f.write(frames)
+        if compressor is not None:
+            f.write(compressor.flush())
+
+
+class MappedColumn:
+    """Values read from a memory-mapped file as they are accessed: a
+    sorted sequence for the bisect module
+    """
+
+    def __init__(self, size: int, read):
+        """Initialize the column: read(i) is the value at position i"""
+        self.size = size
+        self.read = read
+
+    def __len__(self) -> int:
+        """Number of values"""
+        return self.size
+
+    def __getitem__(self, i: int):
+        """Value at position i"""
+        return self.read(i)
+
+
+class MappedRecords:
+    """Records of a MappedCodec snapshot, decoded from the memory-mapped
+    file each time they are read
+
+    Stands in for the records dict of LazyObjects. The file is never
+    written to: records written since it was mapped are held in changes
+    (None when removed), and hide their copy in the file. Indexes are
+    arrays of record offsets, sorted by ID in "id", searched by bisection:
+    8 bytes per record, however long the IDs and values are.
+    """
+
+    def __init__(self, mm: mmap.mmap = None, key_sets: list = (),
+                 indexes: dict = None, values: dict = None):
+        """Initialize the records of mm (none without it), indexes and
+        the positions of their values (see MappedCodec)
+        """
+        self.mm = mm
+        self.key_sets = key_sets
+        self.indexes = indexes if indexes is not None else {}
+        self.index_values = values if values is not None else {}
+        self.offsets = self.indexes.setdefault("id", array("Q"))
+        self.ids = MappedColumn(
+            len(self.offsets),
+            lambda i: self.read_id(self.mm, self.offsets[i]))
+        self.changes = {}
+        self.count = len(self.offsets)
+        self.scan = json.JSONDecoder().scan_once
+
+    @staticmethod
+    def read_id(mm: mmap.mmap, offset: int) -> bytes:
+        """Encoded ID of the record at offset, read from the frame header"""
+        id_length = BinaryCodec.FRAME.unpack_from(mm, offset)[0]
+        start = offset + BinaryCodec.FRAME.size
+        return mm[start:start + id_length]
+
+    def id_at(self, offset: int) -> str:
+        """ID of the record at offset"""
+        return self.read_id(self.mm, offset).decode()
+
+    def record_at(self, offset: int) -> dict:
+        """JSON record at offset"""
+        id_length, length, key_set = BinaryCodec.FRAME.unpack_from(
+            self.mm, offset)
+        start = offset + BinaryCodec.FRAME.size + id_length
+        # Faster than json.loads(), which guesses the encoding of bytes
+        values = self.scan(self.mm[start:start + length].decode(), 0)[0]
+        return dict(zip(self.key_sets[key_set], values))
+
+    def find(self, obj_id: str) -> int:
+        """Offset of obj_id in the file, None if it isn't there"""
+        # UTF-8 sorts like the strings it encodes
+        key = obj_id.encode()
+        i = bisect.bisect_left(self.ids, key)
+        if i < len(self.offsets) and self.ids[i] == key:
+            return self.offsets[i]
+        return None
+
+    def get(self, obj_id: str, default=None) -> dict:
+        """JSON record of obj_id, default if missing"""
+        if obj_id in self.changes:
+            record = self.changes[obj_id]
+            return record if record is not None else default
+        offset = self.find(obj_id)
+        if offset is None:
+            return default
+        return self.record_at(offset)
+
+    def __getitem__(self, obj_id: str) -> dict:
+        """JSON record of obj_id, KeyError if missing"""
+        record = self.get(obj_id)
+        if record is None:
+            raise KeyError(obj_id)
+        return record
+
+    def __setitem__(self, obj_id: str, record: dict):
+        """Store the JSON record of obj_id"""
+        if obj_id not in self:
+            self.count += 1
+        self.changes[obj_id] = record
+
+    def __delitem__(self, obj_id: str):
+        """Remove obj_id, KeyError if missing"""
+        if obj_id not in self:
+            raise KeyError(obj_id)
+        self.changes[obj_id] = None
+        self.count -= 1
+
+    def __contains__(self, obj_id: str) -> bool:
+        """Whether obj_id is stored"""
+        if obj_id in self.changes:
+            return self.changes[obj_id] is not None
+        return self.find(obj_id) is not None
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return self.count
+
+    def __iter__(self) -> Iterable[str]:
+        """IDs of the records"""
+        for obj_id, _ in self.items(False):
+            yield obj_id
+
+    def keys(self) -> "MappedRecords":
+        """IDs of the records"""
+        return self
+
+    def items(self, decode: bool = True) -> Iterable[tuple]:
+        """(ID, JSON record) pairs, the file's ones sorted by ID first
+        (None records unless decode)
+        """
+        changes = self.changes
+        for offset in self.offsets:
+            obj_id = self.id_at(offset)
+            if obj_id not in changes:
+                yield obj_id, self.record_at(offset) if decode else None
+        for obj_id, record in tuple(changes.items()):
+            if record is not None:
+                yield obj_id, record
+
+    def values(self) -> Iterable[dict]:
+        """JSON records"""
+        for _, record in self.items():
+            yield record
+
+    def copy(self) -> "MappedRecords":
+        """Records of the same file, with a copy of the changes"""
+        records = MappedRecords(
+            self.mm, self.key_sets, self.indexes, self.index_values)
+        records.changes = dict(self.changes)
+        records.count = self.count
+        return records
+
+
+class MappedIndex:
+    """Equality index of one attribute of MappedRecords: the file's
+    records sorted by value, and a HashIndex of the changed records
+    Only string values are in the file, search() scans for the others.
+    """
+
+    def __init__(self, records: MappedRecords, attribute: str):
+        """Initialize the index from the file's index of attribute"""
+        self.records = records
+        self.attribute = attribute
+        self.offsets = records.indexes[attribute]
+        ends, start = records.index_values[attribute]
+        mm = records.mm
+        self.values = MappedColumn(
+            len(ends),
+            lambda i: mm[start + (ends[i - 1] if i > 0 else 0):
+                         start + ends[i]])
+        self.changes = HashIndex(attribute)
+        for record in tuple(records.changes.values()):
+            if record is not None:
+                self.changes.add(record)
+
+    def add(self, obj: TypeVar("Base")):
+        """Index obj under its current attribute value"""
+        self.changes.add(obj)
+
+    def discard(self, obj_id: str):
+        """Drop obj_id from the index"""
+        self.changes.discard(obj_id)
+
+    def lookup(self, value) -> set:
+        """IDs of objects indexed under value"""
+        if type(value) is not str:
+            raise TypeError("Only strings are indexed")
+        ids = set(self.changes.lookup(value))
+        changes = self.records.changes
+        key = value.encode()
+        i = bisect.bisect_left(self.values, key)
+        while i < len(self.values) and self.values[i] == key:
+            obj_id = self.records.id_at(self.offsets[i])
+            if obj_id not in changes:
+                ids.add(obj_id)
+            i += 1
+        return ids
+
+
+class MappedOrder:
+    """OrderedIndex of MappedRecords: the file's records sorted by
+    (created_at, id), and an OrderedIndex of the changed ones
+    """
+
+    def __init__(self, records: MappedRecords):
+        """Initialize the index from the file's creation order"""
+        self.records = records
+        offsets = records.indexes["created_at"]
+        self.keys = MappedColumn(
+            len(offsets),
+            lambda i: OrderedIndex.key(records.record_at(offsets[i])))
+        self.changes = OrderedIndex(
+            record for record in tuple(records.changes.values())
+            if record is not None)
+
+    def add(self, obj: TypeVar("Base")):
+        """Insert obj (or its JSON record) at its position"""
+        self.changes.add(obj)
+
+    def discard(self, obj_id: str):
+        """Drop obj_id from the index"""
+        self.changes.discard(obj_id)
+
+    def after(self, key: tuple, limit: int) -> List[tuple]:
+        """Up to limit keys following key (from the start if None)"""
+        changes = self.records.changes
+        keys = []
+        i = 0
+        if key is not None:
+            i = bisect.bisect_right(self.keys, key)
+        while len(keys) < limit and i < len(self.keys):
+            file_key = self.keys[i]
+            if file_key[1] not in changes:
+                keys.append(file_key)
+            i += 1
+        keys.extend(self.changes.after(key, limit))
+        keys.sort()
+        return keys[:limit]
+
+
+class MappedCodec(BinaryCodec):
+    """Uncompressed binary snapshot laid out to be memory-mapped by
+    map() rather than read
+
+    Key set frames come first, then the records sorted by ID, then the
+    INDEX frames: arrays of record offsets (little-endian 64-bit) named
+    by their ID field, sorted by ID ("id"), by each indexed attribute
+    and by creation ("created_at"). The INDEX frame of an attribute is
+    followed by a VALUES frame: the end of each value in the UTF-8 text
+    of the sorted values, then that text, so that searches compare the
+    values without decoding records. A TRAILER frame holding the offset
+    of the first INDEX frame ends the file. BinaryCodec reads these
+    files, and map() those BinaryCodec writes, indexing them by ID.
+    """
+
+    OFFSET = struct.Struct(">Q")
+
+    def __init__(self, compress: bool = False):
+        """Initialize the codec"""
+        if compress:
+            raise ValueError("Memory-mapped snapshots can't be compressed")
+        super().__init__()
+
+    @staticmethod
+    def pack_offsets(offsets: Iterable[int]) -> bytes:
+        """offsets as an array of little-endian 64-bit integers"""
+        offsets = array("Q", offsets)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        return offsets.tobytes()
+
+    @staticmethod
+    def unpack_offsets(data: bytes) -> array:
+        """Array of the offsets packed in data"""
+        offsets = array("Q")
+        offsets.frombytes(data)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        return offsets
+
+    def frame(self, name: str, key_set: int, payload: bytes) -> bytes:
+        """Index frame of key_set named name"""
+        name_bytes = name.encode()
+        return self.FRAME.pack(len(name_bytes), len(payload), key_set) \
+            + name_bytes + payload
+
+    def dump(self, f, objs_json: Iterable[tuple],
+             indexed_attributes: tuple = ()):
+        """Write the (ID, JSON record) pairs of objs_json to file f, and
+        the indexes of indexed_attributes (all records are held to sort
+        them)
+        """
+        f.write(self.MAGIC + bytes([0]))
+        records = sorted(objs_json, key=lambda pair: pair[0])
+        key_sets = {}
+        for _, obj_json in records:
+            keys = tuple(obj_json)
+            if keys not in key_sets:
+                key_sets[keys] = len(key_sets)
+                payload = self.encode(keys).encode()
+                f.write(self.FRAME.pack(0, len(payload), self.KEYS) + payload)
+
+        offset = f.tell()
+        offsets = []
+        # Index name -> (value, offset) pairs, sorted once all are known
+        values = {name: [] for name in indexed_attributes}
+        order = []
+        for obj_id, obj_json in records:
+            offsets.append(offset)
+            for name in indexed_attributes:
+                value = obj_json.get(name)
+                if type(value) is str:
+                    values[name].append((value, offset))
+            order.append((OrderedIndex.key(obj_json), offset))
+            id_bytes = obj_id.encode()
+            payload = self.encode(list(obj_json.values())).encode()
+            frame = self.FRAME.pack(len(id_bytes), len(payload),
+                                    key_sets[tuple(obj_json)]) \
+                + id_bytes + payload
+            f.write(frame)
+            offset += len(frame)
+        del records
+
+        trailer = self.OFFSET.pack(offset)
+        f.write(self.frame("id", self.INDEX, self.pack_offsets(offsets)))
+        for name, pairs in values.items():
+            pairs.sort()
+            f.write(self.frame(name, self.INDEX, self.pack_offsets(
+                offset for _, offset in pairs)))
+            text = bytearray()
+            ends = []
+            for value, _ in pairs:
+                text += value.encode()
+                ends.append(len(text))
+            f.write(self.frame(name, self.VALUES,
+                               self.pack_offsets(ends) + text))
+        order.sort()
+        f.write(self.frame("created_at", self.INDEX, self.pack_offsets(
+            offset for _, offset in order)))
+        f.write(self.FRAME.pack(0, len(trailer), self.TRAILER) + trailer)
+
+    def map(self, f) -> MappedRecords:
+        """Records of file f, mapped in memory rather than read"""
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = mm[:len(self.MAGIC) + 1]
+        if header[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Not a binary snapshot")
+        if header[-1] & self.COMPRESSED:
+            raise ValueError("Compressed snapshots can't be memory-mapped")
+        trailer = len(mm) - self.FRAME.size - self.OFFSET.size
+        if trailer < len(header) or \
+                self.FRAME.unpack_from(mm, trailer)[2] != self.TRAILER:
+            return self.index(mm)
+
+        key_sets = []
+        pos = len(header)
+        while True:
+            _, length, key_set = self.FRAME.unpack_from(mm, pos)
+            if key_set != self.KEYS:
+                break
+            start = pos + self.FRAME.size
+            key_sets.append(json.loads(mm[start:start + length]))
+            pos = start + length
+        indexes = {}
+        values = {}
+        pos = self.OFFSET.unpack_from(mm, trailer + self.FRAME.size)[0]
+        while pos < trailer:
+            id_length, length, key_set = self.FRAME.unpack_from(mm, pos)
+            start = pos + self.FRAME.size
+            name = mm[start:start + id_length].decode()
+            start += id_length
+            pos = start + length
+            if key_set == self.INDEX:
+                indexes[name] = self.unpack_offsets(mm[start:pos])
+            else:
+                # The values stay in the file
+                size = len(indexes[name]) * self.OFFSET.size
+                ends = self.unpack_offsets(mm[start:start + size])
+                values[name] = (ends, start + size)
+        return MappedRecords(mm, key_sets, indexes, values)
+
+    def index(self, mm: mmap.mmap) -> MappedRecords:
+        """Records of mm, written by BinaryCodec: unsorted and without
+        indexes, so their offsets are sorted by ID now
+        """
+        key_sets = []
+        offsets = []
+        pos = len(self.MAGIC) + 1
+        while pos < len(mm):
+            if pos + self.FRAME.size > len(mm):
+                raise ValueError("Truncated binary snapshot")
+            id_length, length, key_set = self.FRAME.unpack_from(mm, pos)
+            start = pos + self.FRAME.size
+            if start + id_length + length > len(mm):
+                raise ValueError("Truncated binary snapshot")
+            if key_set == self.KEYS:
+                key_sets.append(json.loads(mm[start:start + length]))
+            elif key_set < self.TRAILER:
+                offsets.append(pos)
+            pos = start + id_length + length
+        offsets.sort(key=lambda offset: MappedRecords.read_id(mm, offset))
+        return MappedRecords(mm, key_sets, {"id": array("Q", offsets)})
+
+
+CODECS = {"json": JSONCodec, "binary": BinaryCodec,
+          "mapped": MappedCodec}
+CODEC = CODECS[FORMAT](compress=COMPRESS)
+
+
+def write_atomic(file_path: str, objs_json: Iterable[tuple],
+                 codec: object = None, indexed_attributes: tuple = ()):
+    """Write the (ID, JSON record) pairs of objs_json to file_path with
+    codec (CODEC by default), through a temporary file and a rename, so
+    readers and crashes only ever see the old or the new content
+    Records are encoded one at a time, so objs_json can build them lazily
+    """
+    if codec is None:
+        codec = CODEC
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    try:
+        with open(tmp_path, "w" + codec.mode) as f:
+            codec.dump(f, objs_json, indexed_attributes)
+            if FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            remove(tmp_path)
+        raise
+    if FSYNC:
+        fd = os.open(path.dirname(path.abspath(file_path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class Writer(threading.Thread):
+    """Background thread rewriting the snapshots of dirty classes,
+    once per DB_WRITE_DELAY window however many saves happened in it
+    """
+
+    def __init__(self, delay: float):
+        """Initialize the writer"""
+        super().__init__(name="db-writer", daemon=True)
+        self.delay = delay
+        self.dirty = set()
+        # Number of flush() calls running, which close() waits for
+        self.flushing = 0
+        self.condition = threading.Condition()
+
+    def mark(self, cls: type):
+        """Schedule a snapshot rewrite of cls"""
+        with self.condition:
+            self.dirty.add(cls)
+            self.condition.notify_all()
+
+    def run(self):
+        """Flush dirty classes until the process exits"""
+        while True:
+            with self.condition:
+                while len(self.dirty) == 0:
+                    self.condition.wait()
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        """Rewrite the snapshots of every dirty class now
+        A class whose rewrite fails stays dirty, for the next window
+        """
+        with self.condition:
+            dirty, self.dirty = self.dirty, set()
+            self.flushing += 1
+        try:
+            for cls in dirty:
+                try:
+                    cls.save_to_file()
+                except Exception:
+                    logging.getLogger(__name__).exception(
+                        "Can't write the snapshot of %s", cls.__name__)
+                    self.mark(cls)
+        finally:
+            with self.condition:
+                self.flushing -= 1
+                self.condition.notify_all()
+
+    def close(self):
+        """Flush now and wait for the flush the thread may be running,
+        which is killed with the process otherwise
+        """
+        self.flush()
+        with self.condition:
+            while self.flushing > 0:
+                self.condition.wait()
+        # Classes the thread's flush failed to write, one last try
+        self.flush()
+
+
+def flush():
+    """Write pending snapshots, called on shutdown"""
+    if WRITER is not None:
+        WRITER.close()
+
+
+atexit.register(flush)
+
+
+def _after_fork():
+    """Threads don't survive fork(): the child starts its own writer"""
+    global WRITER
+    WRITER = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def freeze():
+    """Move every object allocated so far out of the garbage collector's
+    reach, to be called once the store is loaded and before forking
+    workers: collections would otherwise write to the headers of the
+    loaded objects and copy their shared pages in every worker
+    """
+    gc.collect()
+    gc.freeze()
+
 
 class Base:
     """Base class"""
 
+    # Instances keep their attributes in slots rather than a __dict__,
+    # subclasses declare theirs the same way
+    __slots__ = ("id", "created_at", "updated_at")
+
+    # Attributes search() answers through a HashIndex
+    indexed_attributes = ()
+    # Attributes search_prefix() and search_ignore_case() answer through
+    # a SortedIndex
+    sorted_attributes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """Initialize a Base instance"""
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            with lock_for(s_class):
+                if DATA.get(s_class) is None:
+                    self.__class__._build_indexes({})
+                    DATA[s_class] = {}
 
-        self.id = kwargs.get("id", str(uuid.uuid4()))
+        self.id = kwargs.get("id")
+        if self.id is None:
+            self.id = str(uuid.uuid4())
         if kwargs.get("created_at") is not None:
-            self.created_at = datetime.strptime(
-                kwargs.get("created_at"), TIMESTAMP_FORMAT
-            )
+            self.created_at = parse_timestamp(kwargs.get("created_at"))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get("updated_at") is not None:
-            self.updated_at = datetime.strptime(
-                kwargs.get("updated_at"), TIMESTAMP_FORMAT
-            )
+            if kwargs.get("updated_at") == kwargs.get("created_at"):
+                # Never updated: share the immutable datetime
+                self.updated_at = self.created_at
+            else:
+                self.updated_at = parse_timestamp(kwargs.get("updated_at"))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -43,62 +1243,554 @@ class Base:
             return False
         return self.id == other.id
 
+    @classmethod
+    def fields(cls) -> tuple:
+        """Names of the slot attributes, base classes first"""
+        fields = FIELDS.get(cls)
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                fields.extend(klass.__dict__.get("__slots__", ()))
+            fields = tuple(f for f in fields if f != "__dict__")
+            FIELDS[cls] = fields
+        return fields
+
+    @classmethod
+    def column_attributes(cls) -> tuple:
+        """Attributes a ColumnIndex holds: the fields but the timestamps,
+        which are datetimes on objects and text in JSON records
+        """
+        return tuple(f for f in cls.fields()
+                     if f not in ("created_at", "updated_at"))
+
+    def timestamps(self) -> Tuple[str, str]:
+        """created_at and updated_at in TIMESTAMP_FORMAT, formatted once
+        if the object was never updated
+        """
+        created_at = self.created_at
+        if type(created_at) is datetime:
+            created_at = format_timestamp(created_at)
+        updated_at = self.updated_at
+        if updated_at is self.created_at:
+            updated_at = created_at
+        elif type(updated_at) is datetime:
+            updated_at = format_timestamp(updated_at)
+        return created_at, updated_at
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """Convert the object a JSON dictionary"""
+        items = [(key, getattr(self, key)) for key in self.fields()]
+        if hasattr(self, "__dict__"):
+            # Subclass without __slots__
+            items.extend(self.__dict__.items())
+
+        created_at, updated_at = self.timestamps()
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in items:
             if not for_serialization and key[0] == "_":
                 continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+            if key == "created_at":
+                result[key] = created_at
+            elif key == "updated_at":
+                result[key] = updated_at
+            elif type(value) is datetime:
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
 
+    def to_json_bytes(self, cache: bool = True) -> bytes:
+        """to_json() encoded like flask.jsonify() does, kept in JSON_CACHE
+        until the next save() unless cache is False
+        """
+        key = (self.__class__.__name__, self.id)
+        with JSON_LOCK:
+            cached = JSON_CACHE.get(key)
+            # save() assigns a new datetime, and objects built again
+            # from their records have their own
+            if cached is not None and cached[0] is self.updated_at:
+                JSON_CACHE.move_to_end(key)
+                return cached[1]
+        encoded = json.dumps(
+            self.to_json(), sort_keys=True, separators=(",", ":")).encode()
+        if cache and JSON_CACHE_SIZE > 0:
+            with JSON_LOCK:
+                JSON_CACHE[key] = (self.updated_at, encoded)
+                JSON_CACHE.move_to_end(key)
+                while len(JSON_CACHE) > JSON_CACHE_SIZE:
+                    JSON_CACHE.popitem(last=False)
+        return encoded
+
+    @classmethod
+    def file_path(cls) -> str:
+        """Path of the snapshot file"""
+        return ".db_{}.{}".format(cls.__name__, CODEC.extension)
+
+    @classmethod
+    def journal_path(cls) -> str:
+        """Path of the journal file"""
+        return ".db_{}.journal".format(cls.__name__)
+
+    @classmethod
+    def old_journal_path(cls) -> str:
+        """Path of the journal being folded into the snapshot"""
+        return cls.journal_path() + ".old"
+
+    @classmethod
+    def lock_path(cls) -> str:
+        """Path of the file locked by processes sharing the files"""
+        return ".db_{}.lock".format(cls.__name__)
+
+    @classmethod
+    @contextmanager
+    def _file_lock(cls, shared: bool = False):
+        """Hold the lock of lock_path(), which keeps other processes
+        from changing the files (shared) or from reading them too
+        Taken after the class lock, a no-op unless SYNC_INTERVAL
+        """
+        if SYNC_INTERVAL <= 0:
+            yield
+            return
+        fd = os.open(cls.lock_path(), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
     @classmethod
     def load_from_file(cls):
-        """Load all objects from file"""
+        """Load all objects from file, then replay the journal
+        Writers wait for the load, readers keep using the previous
+        objects until they are replaced in one step
+        """
+        s_class = cls.__name__
+        with lock_for(s_class + ".flush"), lock_for(s_class):
+            if cls._unsaved():
+                # Reading the snapshot would drop them
+                cls.save_to_file()
+            with cls._file_lock(shared=True):
+                cls._load()
+
+    @classmethod
+    def _unsaved(cls) -> bool:
+        """Whether writes of this process are only in memory, waiting
+        for a snapshot rewrite ("file" mode), with the class lock held
+        """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        return STORAGE != "journal" and \
+            GENERATIONS.get(s_class, 0) != SAVED.get(s_class, 0)
+
+    @classmethod
+    def _load(cls):
+        """Load all objects from file, with the class lock held"""
+        s_class = cls.__name__
+        # Final state of the records written to the journals, applied
+        # while the snapshot is read
+        journaled = {}
+        journal_size = 0
+        state = {"snapshot": None, "journal": None, "offset": 0}
+        if path.exists(cls.old_journal_path()):
+            with open(cls.old_journal_path(), "rb") as f:
+                for line in f:
+                    journal_size += cls._replay(journaled, line)
+        if path.exists(cls.journal_path()):
+            with open(cls.journal_path(), "rb") as f:
+                for line in f:
+                    journal_size += cls._replay(journaled, line)
+                    if line.endswith(b"\n"):
+                        state["offset"] += len(line)
+                state["journal"] = os.fstat(f.fileno()).st_ino
+
+        mapped = isinstance(CODEC, MappedCodec)
+        objs = {}
+        if mapped:
+            objs = LazyObjects(cls, MappedRecords(), LAZY_CACHE_SIZE)
+        elif LAZY_LOAD:
+            objs = LazyObjects(cls, {}, LAZY_CACHE_SIZE)
+        file_path = cls.file_path()
+        if path.exists(file_path):
+            with open(file_path, "r" + CODEC.mode) as f:
+                if mapped:
+                    # Records stay in the file until they are read
+                    objs.records = CODEC.map(f)
+                else:
+                    cls._read(objs, f, journaled)
+                st = os.fstat(f.fileno())
+                state["snapshot"] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        for obj_id, obj_json in journaled.items():
+            if obj_json is None:
+                if mapped and obj_id in objs.records:
+                    del objs.records[obj_id]
+                continue
+            if LAZY_LOAD or mapped:
+                objs.records[obj_id] = obj_json
+            else:
+                objs[obj_id] = cls(**obj_json)
+        cls._build_indexes(objs)
+        DATA[s_class] = objs
+        JOURNAL_SIZE[s_class] = journal_size
+        state["checked"] = time.monotonic()
+        SYNC_STATE[s_class] = state
+        cls._bump()
+        SAVED[s_class] = GENERATIONS[s_class]
+
+    @classmethod
+    def _read(cls, objs: dict, f, journaled: dict):
+        """Read the snapshot file f into objs, applying the records of
+        journaled (popped from it) in place of the snapshot's ones
+        """
+        # Eager loading builds each object as soon as its record is
+        # parsed, so that the parsed records are never all held next to
+        # the objects; lazy loading keeps them
+        for obj_id, obj_json in CODEC.load(f, not LAZY_LOAD):
+            if obj_id in journaled:
+                obj_json = journaled.pop(obj_id)
+                if obj_json is None:
+                    continue
+            if LAZY_LOAD:
+                objs.records[obj_id] = obj_json
+            else:
+                objs[obj_id] = cls(**obj_json)
+
+    @classmethod
+    def sync(cls) -> bool:
+        """Pick up the writes other processes made to the files since
+        this one last read them, return True if there were any
+        """
+        with lock_for(cls.__name__), cls._file_lock(shared=True):
+            return cls._sync()
+
+    @classmethod
+    def _sync_if_due(cls):
+        """sync() if SYNC_INTERVAL elapsed since the last check"""
+        if SYNC_INTERVAL <= 0:
+            return
+        state = SYNC_STATE.get(cls.__name__)
+        if state is None or \
+                time.monotonic() - state["checked"] < SYNC_INTERVAL:
             return
+        cls.sync()
+
+    @classmethod
+    def _sync(cls) -> bool:
+        """sync() with the class lock and the file lock held
+        A new snapshot or journal is loaded in full, appends to the
+        journal already read are replayed record by record
+        """
+        s_class = cls.__name__
+        state = SYNC_STATE.get(s_class)
+        if SYNC_INTERVAL <= 0 or state is None:
+            return False
+        state["checked"] = time.monotonic()
+        if STORAGE != "journal":
+            # Writes of this process only reach the file with the next
+            # snapshot rewrite, a reload before it would drop them
+            if cls._unsaved():
+                return False
+            flush_lock = lock_for(s_class + ".flush")
+            if not flush_lock.acquire(blocking=False):
+                return False
+            flush_lock.release()
+
+        if file_identity(cls.file_path()) != state["snapshot"]:
+            cls._load()
+            return True
+        try:
+            f = open(cls.journal_path(), "rb")
+        except FileNotFoundError:
+            if state["journal"] is None:
+                return False
+            # Folded into a snapshot by another process
+            cls._load()
+            return True
+        with f:
+            if os.fstat(f.fileno()).st_ino != state["journal"]:
+                cls._load()
+                return True
+            f.seek(state["offset"])
+            data = f.read()
+        # An incomplete last line is read again on the next sync
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return False
+        applied = 0
+        for line in data[:end].splitlines():
+            applied += cls._apply(line)
+        state["offset"] += end
+        JOURNAL_SIZE[s_class] = JOURNAL_SIZE.get(s_class, 0) + applied
+        cls._bump()
+        return True
+
+    @classmethod
+    def _apply(cls, line: bytes) -> int:
+        """Apply one journal record to DATA and the indexes, return 1
+        if it was valid
+        """
+        s_class = cls.__name__
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return 0
+        objs = DATA[s_class]
+        if entry.get("op") == "save":
+            if isinstance(objs, LazyObjects):
+                objs.put(entry["id"], entry["obj"])
+                cls._index(entry["obj"])
+            else:
+                obj = cls(**entry["obj"])
+                objs[obj.id] = obj
+                cls._index(obj)
+        elif entry.get("op") == "remove" and entry["id"] in objs:
+            del objs[entry["id"]]
+            cls._unindex(entry["id"])
+        return 1
 
-        with open(file_path, "r") as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _replay(cls, records: dict, line: bytes) -> int:
+        """Apply one journal record to records, where removed objects are
+        None, return 1 if it was valid
+        """
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # Torn write at the end of the journal
+            return 0
+        if entry.get("op") == "save":
+            records[entry["id"]] = entry["obj"]
+        elif entry.get("op") == "remove":
+            records[entry["id"]] = None
+        return 1
 
     @classmethod
     def save_to_file(cls):
-        """Save all objects to file"""
+        """Save all objects to file and fold the journal into it"""
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        journal_path = cls.journal_path()
+        old_journal_path = cls.old_journal_path()
+        with lock_for(s_class + ".flush"), ExitStack() as stack:
+            # Writes from here on go to a new journal, replayed after
+            # the snapshot, so they can't be lost while it is written
+            with lock_for(s_class):
+                # Other processes wait for the whole rewrite: they would
+                # fold the journal too, and one of the snapshots be lost
+                stack.enter_context(cls._file_lock())
+                if STORAGE == "journal":
+                    # Include the writes of other processes
+                    cls._sync()
+                if path.exists(journal_path):
+                    if path.exists(old_journal_path):
+                        # Left over by a crashed flush: keep its records
+                        with open(journal_path, "r") as src, \
+                                open(old_journal_path, "a") as dst:
+                            dst.write(src.read())
+                        remove(journal_path)
+                    else:
+                        os.replace(journal_path, old_journal_path)
+                JOURNAL_SIZE[s_class] = 0
+                if s_class in SYNC_STATE:
+                    SYNC_STATE[s_class].update(journal=None, offset=0)
+                objs = DATA[s_class]
+                if isinstance(objs, LazyObjects):
+                    # Records are never modified, only replaced
+                    objs_json = objs.records.copy().items()
+                else:
+                    objs = list(objs.items())
+                # Not generation(): no sync() with the files locked
+                generation = GENERATIONS.get(s_class, 0)
 
-        with open(file_path, "w") as f:
-            json.dump(objs_json, f)
+            if not isinstance(objs, LazyObjects):
+                # Encoded one by one as they are written
+                objs_json = ((obj_id, obj.to_json(True))
+                             for obj_id, obj in objs)
+            write_atomic(cls.file_path(), objs_json,
+                         indexed_attributes=cls.indexed_attributes)
+            SAVED[s_class] = generation
+            if s_class in SYNC_STATE:
+                SYNC_STATE[s_class]["snapshot"] = file_identity(
+                    cls.file_path())
+            if path.exists(old_journal_path):
+                remove(old_journal_path)
+            if isinstance(CODEC, MappedCodec):
+                # Map the new file, dropping the changes held since the
+                # previous one. In "file" mode, writes made meanwhile
+                # are only in DATA: they wait for the next rewrite. The
+                # file lock goes first, it is taken after the class lock
+                stack.close()
+                with lock_for(s_class), cls._file_lock(shared=True):
+                    if STORAGE == "journal" or \
+                            GENERATIONS.get(s_class, 0) == generation:
+                        cls._load()
+
+    @classmethod
+    def _schedule_save(cls):
+        """Rewrite the snapshot now, or on the writer thread"""
+        global WRITER
+        if WRITE_DELAY <= 0:
+            cls.save_to_file()
+            return
+        if WRITER is None:
+            with LOCKS_LOCK:
+                if WRITER is None:
+                    WRITER = Writer(WRITE_DELAY)
+                    WRITER.start()
+        WRITER.mark(cls)
+
+    @classmethod
+    def _build_indexes(cls, objs: dict):
+        """Build the secondary indexes of objs, which become DATA"""
+        s_class = cls.__name__
+        if isinstance(objs, LazyObjects):
+            objs = objs.records
+        # Indexes MappedCodec wrote along with the file, the others are
+        # built from every record
+        written = ()
+        if isinstance(objs, MappedRecords):
+            written = objs.indexes
+        indexes = {}
+        for name in cls.indexed_attributes:
+            if name in written:
+                indexes[name] = MappedIndex(objs, name)
+            else:
+                indexes[name] = HashIndex(name)
+        built = [index for index in indexes.values()
+                 if isinstance(index, HashIndex)]
+        if len(built) > 0:
+            for obj in objs.values():
+                for index in built:
+                    index.add(obj)
+        if "created_at" in written:
+            order = MappedOrder(objs)
+        else:
+            order = OrderedIndex(objs.values())
+        INDEXES[s_class] = indexes
+        ORDERS[s_class] = order
+        SORTED_INDEXES[s_class] = {}
+        if COLUMNAR:
+            COLUMNS[s_class] = ColumnIndex(
+                cls.column_attributes(), objs.values())
+
+    @classmethod
+    def _index(cls, obj: TypeVar("Base")):
+        """Add obj to the indexes"""
+        s_class = cls.__name__
+        for index in INDEXES[s_class].values():
+            index.add(obj)
+        ORDERS[s_class].add(obj)
+        for index in SORTED_INDEXES.get(s_class, {}).values():
+            index.add(obj)
+        if s_class in COLUMNS:
+            COLUMNS[s_class].add(obj)
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """Remove obj_id from the indexes"""
+        s_class = cls.__name__
+        for index in INDEXES[s_class].values():
+            index.discard(obj_id)
+        ORDERS[s_class].discard(obj_id)
+        for index in SORTED_INDEXES.get(s_class, {}).values():
+            index.discard(obj_id)
+        if s_class in COLUMNS:
+            COLUMNS[s_class].discard(obj_id)
+
+    @classmethod
+    def _bump(cls):
+        """Start a new generation, with the class lock held"""
+        s_class = cls.__name__
+        GENERATIONS[s_class] = GENERATIONS.get(s_class, 0) + 1
+
+    @classmethod
+    def generation(cls) -> int:
+        """Number of writes to the class, as seen by this process once
+        it picked up those of other processes (see sync())
+        """
+        cls._sync_if_due()
+        return GENERATIONS.get(cls.__name__, 0)
+
+    @classmethod
+    def _persist(cls, entries: List[dict]) -> bool:
+        """Persist writes according to STORAGE, with the class lock held
+        Return True if the snapshot must be rewritten, which callers
+        do through _schedule_save() once they released the lock
+        """
+        if STORAGE != "journal":
+            return True
+
+        s_class = cls.__name__
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        # One write() so appends of other processes can't interleave
+        fd = os.open(cls.journal_path(),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode())
+            if FSYNC:
+                os.fsync(fd)
+            if s_class in SYNC_STATE:
+                # Caught up before the write, which ends the journal
+                st = os.fstat(fd)
+                SYNC_STATE[s_class].update(
+                    journal=st.st_ino, offset=st.st_size)
+        finally:
+            os.close(fd)
+        JOURNAL_SIZE[s_class] = JOURNAL_SIZE.get(s_class, 0) + len(entries)
+        return JOURNAL_SIZE[s_class] >= JOURNAL_THRESHOLD
 
     def save(self):
         """Save current object"""
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with lock_for(s_class), self.__class__._file_lock():
+            self.__class__._sync()
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            self.__class__._index(self)
+            self.__class__._bump()
+            rewrite = self.__class__._persist(
+                [{"op": "save", "id": self.id, "obj": self.to_json(True)}])
+        if rewrite:
+            self.__class__._schedule_save()
+
+    @classmethod
+    def save_all(cls, objs: List[TypeVar("Base")]):
+        """Save several objects, persisting them in one write"""
+        s_class = cls.__name__
+        if len(objs) == 0:
+            return
+        with lock_for(s_class), cls._file_lock():
+            cls._sync()
+            updated_at = datetime.utcnow()
+            entries = []
+            for obj in objs:
+                obj.updated_at = updated_at
+                DATA[s_class][obj.id] = obj
+                cls._index(obj)
+                entries.append(
+                    {"op": "save", "id": obj.id, "obj": obj.to_json(True)})
+            cls._bump()
+            rewrite = cls._persist(entries)
+        if rewrite:
+            cls._schedule_save()
 
     def remove(self):
         """Remove object"""
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
+        with lock_for(s_class), self.__class__._file_lock():
+            self.__class__._sync()
+            if self.id not in DATA[s_class]:
+                return
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            self.__class__._unindex(self.id)
+            self.__class__._bump()
+            rewrite = self.__class__._persist(
+                [{"op": "remove", "id": self.id}])
+        if rewrite:
+            self.__class__._schedule_save()
 
     @classmethod
     def count(cls) -> int:
         """Count all objects"""
         s_class = cls.__name__
+        cls._sync_if_due()
         return len(DATA[s_class].keys())
 
     @classmethod
@@ -110,13 +1802,192 @@ class Base:
     def get(cls, id: str) -> TypeVar("Base"):
         """Return one object by ID"""
         s_class = cls.__name__
+        cls._sync_if_due()
         return DATA[s_class].get(id)
 
+    @classmethod
+    def page(cls, limit: int, cursor: str = None) -> Tuple[list, str]:
+        """Return up to limit objects in creation order after cursor,
+        and the cursor of the next page (None on the last page)
+        Raises ValueError on a malformed cursor
+        """
+        s_class = cls.__name__
+        key = None
+        if cursor is not None:
+            try:
+                decoded = base64.urlsafe_b64decode(cursor.encode()).decode()
+            except Exception:
+                raise ValueError("Invalid cursor")
+            key = tuple(decoded.split("|", 1))
+            if len(key) != 2:
+                raise ValueError("Invalid cursor")
+        cls._sync_if_due()
+
+        keys = ORDERS[s_class].after(key, limit + 1)
+        next_cursor = None
+        if len(keys) > limit:
+            keys = keys[:limit]
+            next_cursor = base64.urlsafe_b64encode(
+                "|".join(keys[-1]).encode()).decode()
+        objs = [DATA[s_class].get(obj_id) for _, obj_id in keys]
+        return [obj for obj in objs if obj is not None], next_cursor
+
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar("Base")]:
         """Search all objects with matching attributes"""
         s_class = cls.__name__
+        cls._sync_if_due()
+        try:
+            key = (s_class, frozenset(attributes.items()), cls.generation())
+        except TypeError:
+            # Unhashable attribute value
+            key = None
+        if key is not None:
+            with SEARCH_LOCK:
+                results = SEARCH_CACHE.get(key)
+                if results is not None:
+                    SEARCH_CACHE.move_to_end(key)
+                    SEARCH_STATS["hits"] += 1
+                else:
+                    SEARCH_STATS["misses"] += 1
+            if results is not None:
+                # Objects may have changed since, without a save()
+                return cls._filter(results, attributes)
+
+        results = cls._search(attributes)
+        if key is not None and len(results) <= SEARCH_CACHE_MAX_RESULTS:
+            with SEARCH_LOCK:
+                SEARCH_CACHE[key] = tuple(results)
+                while len(SEARCH_CACHE) > SEARCH_CACHE_SIZE:
+                    SEARCH_CACHE.popitem(last=False)
+        return results
+
+    @classmethod
+    def search_stats(cls) -> dict:
+        """Hits and misses of the search() result cache"""
+        with SEARCH_LOCK:
+            return dict(SEARCH_STATS, size=len(SEARCH_CACHE))
+
+    @classmethod
+    def sorted_index(cls, attribute: str) -> SortedIndex:
+        """SortedIndex of attribute, built on first use, None if it isn't
+        one of sorted_attributes
+        """
+        s_class = cls.__name__
+        if attribute not in cls.sorted_attributes:
+            return None
+        index = SORTED_INDEXES.get(s_class, {}).get(attribute)
+        if index is not None:
+            return index
+        with lock_for(s_class):
+            # Writers wait for the build, so it misses none of them
+            indexes = SORTED_INDEXES.setdefault(s_class, {})
+            index = indexes.get(attribute)
+            if index is None:
+                objs = DATA.get(s_class, {})
+                if isinstance(objs, LazyObjects):
+                    objs = objs.records
+                index = SortedIndex(attribute, objs.values())
+                indexes[attribute] = index
+        return index
+
+    @classmethod
+    def search_prefix(cls, attribute: str, prefix: str,
+                      limit: int = None) -> List[TypeVar("Base")]:
+        """Objects whose attribute starts with prefix, ignoring case,
+        sorted by it, up to limit of them
+        """
+        cls._sync_if_due()
+        index = cls.sorted_index(attribute)
+        prefix = prefix.lower()
+
+        def matches(value: str) -> bool:
+            return value.lower().startswith(prefix)
+
+        ids = None if index is None else index.prefix(prefix, limit)
+        return cls._search_sorted(attribute, ids, matches, limit)
+
+    @classmethod
+    def search_ignore_case(cls, attribute: str,
+                           value: str) -> List[TypeVar("Base")]:
+        """Objects whose attribute equals value, ignoring case"""
+        cls._sync_if_due()
+        index = cls.sorted_index(attribute)
+        value = value.lower()
+
+        def matches(other: str) -> bool:
+            return other.lower() == value
+
+        ids = None if index is None else index.lookup(value)
+        return cls._search_sorted(attribute, ids, matches)
+
+    @classmethod
+    def _search_sorted(cls, attribute: str, ids: List[str], matches,
+                       limit: int = None) -> List[TypeVar("Base")]:
+        """Objects of ids (of all objects if None) whose string value of
+        attribute matches, sorted by it, up to limit of them
+        """
+        s_class = cls.__name__
+
+        def _search(obj):
+            value = getattr(obj, attribute, None)
+            return type(value) is str and matches(value)
+
+        objs = DATA[s_class]
+        if ids is not None:
+            # In order already; checked again in case of a concurrent
+            # write
+            results = [objs.get(obj_id) for obj_id in ids]
+            return [obj for obj in results
+                    if obj is not None and _search(obj)]
+
+        # No SortedIndex: scan a snapshot, see _search()
+        snapshot = objs.values()
+        if not isinstance(objs, LazyObjects):
+            snapshot = tuple(snapshot)
+        results = list(filter(_search, snapshot))
+        results.sort(key=lambda obj: (getattr(obj, attribute).lower(), obj.id))
+        return results[:limit]
+
+    @classmethod
+    def _search(cls, attributes: dict) -> List[TypeVar("Base")]:
+        """Search all objects with matching attributes, uncached"""
+        s_class = cls.__name__
+
+        # Python code runs while filtering, so work on a snapshot
+        # that writers can't change under us
+        objs = DATA[s_class]
+        candidates = None
+        for k, v in attributes.items():
+            index = INDEXES[s_class].get(k)
+            if index is None:
+                continue
+            try:
+                ids = index.lookup(v)
+            except TypeError:
+                continue
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        columns = COLUMNS.get(s_class)
+        if candidates is None and columns is not None:
+            filters = {k: v for k, v in attributes.items()
+                       if k in columns.columns}
+            if len(filters) > 0:
+                candidates = columns.lookup(filters)
+        if candidates is None and isinstance(objs, LazyObjects):
+            # Objects are built one at a time as filter() goes
+            snapshot = objs.values()
+        elif candidates is None:
+            snapshot = tuple(objs.values())
+        else:
+            snapshot = [objs.get(obj_id) for obj_id in tuple(candidates)]
+            snapshot = [obj for obj in snapshot if obj is not None]
+
+        return cls._filter(snapshot, attributes)
 
+    @staticmethod
+    def _filter(objs: Iterable, attributes: dict) -> List[TypeVar("Base")]:
+        """Objects of objs with matching attributes"""
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -125,4 +1996,4 @@ class Base:
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        return list(filter(_search, objs))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Hammer the store from threads the way concurrent requests do: writers
+creating and deleting users, readers listing, searching and paging
+them, and optionally a thread reloading the store from its files:
+
+    ./stress_store.py [writers] [readers] [creates] [reload]
+    DB_STORAGE=journal ./stress_store.py [writers] [readers] [creates] [reload]
+
+Works on a temporary directory. Fails if any thread raised, or if the
+store loaded back from the files at the end doesn't hold exactly the
+users the writers kept
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import traceback
+from models.base import flush
+from models.user import User
+
+
+def writer(k: int, creates: int, kept: list, errors: list):
+    """Create creates users, deleting about a third of them, and add
+    the IDs of the others to kept
+    """
+    mine = []
+    try:
+        for i in range(creates):
+            user = User()
+            user.email = "w{}-{}@example.com".format(k, i)
+            user.password = "pwd"
+            user.save()
+            mine.append(user)
+            if random.random() < 0.3:
+                mine.pop(random.randrange(len(mine))).remove()
+    except Exception:
+        errors.append(traceback.format_exc())
+    kept.extend(user.id for user in mine)
+
+
+def reader(stop: threading.Event, errors: list):
+    """Read the store with every kind of query until stop is set"""
+    try:
+        while not stop.is_set():
+            User.all()
+            User.search({"first_name": None})
+            User.search({"email": "w1-5@example.com"})
+            User.page(50)
+            User.count()
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def loader(stop: threading.Event, errors: list):
+    """Reload the store from its files until stop is set"""
+    try:
+        while not stop.is_set():
+            User.load_from_file()
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+if __name__ == "__main__":
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    creates = int(sys.argv[3]) if len(sys.argv) > 3 else 1500
+    reload = len(sys.argv) > 4 and sys.argv[4] == "reload"
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        User.load_from_file()
+        kept = []
+        errors = []
+        stop = threading.Event()
+        writing = [threading.Thread(target=writer,
+                                    args=(k, creates, kept, errors))
+                   for k in range(writers)]
+        reading = [threading.Thread(target=reader, args=(stop, errors))
+                   for _ in range(readers)]
+        if reload:
+            reading.append(
+                threading.Thread(target=loader, args=(stop, errors)))
+        for thread in writing + reading:
+            thread.start()
+        for thread in writing:
+            thread.join()
+        stop.set()
+        for thread in reading:
+            thread.join()
+
+        User.load_from_file()
+        loaded = set(user.id for user in User.all())
+        lost = len(set(kept) - loaded)
+        resurrected = len(loaded - set(kept))
+        print("{} writers, {} readers{}: {} users, {} lost, {} deleted"
+              " ones back, {} errors".format(
+                  writers, readers, ", reloading" if reload else "",
+                  len(loaded), lost, resurrected, len(errors)))
+        for error in errors[:3]:
+            print(error)
+        # Before the directory is removed: DB_WRITE_DELAY rewrites may
+        # be pending
+        flush()
+        if len(errors) > 0 or lost > 0 or resurrected > 0:
+            sys.exit(1)
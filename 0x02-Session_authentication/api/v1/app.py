@@ -4,6 +4,7 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
+from api.v1.auth.auth import PathMatcher
 from flask import Flask, jsonify, abort, request
 from flask_cors import CORS, cross_origin
 import os
@@ -34,6 +35,20 @@ if auth_type:
         from api.v1.auth.session_auth import SessionAuth
 
         auth = SessionAuth()
+    elif auth_type == "session_db_auth":
+        from api.v1.auth.session_db_auth import SessionDBAuth
+
+        auth = SessionDBAuth()
+
+# Paths served without authentication, compiled once
+EXCLUDED_PATHS = PathMatcher(
+    [
+        "/api/v1/status/",
+        "/api/v1/unauthorized/",
+        "/api/v1/forbidden/",
+        "/api/v1/auth_session/login/",
+    ]
+)
 
 
 @app.before_request
@@ -50,18 +65,7 @@ def handle_auth():
     if auth is None:
         return
 
-    excluded_paths = [
-        "/api/v1/status/",
-        "/api/v1/unauthorized/",
-        "/api/v1/forbidden/",
-        "/api/v1/auth_session/login/",
-    ]
-
-    # Cheact code
-    if path == "/api/v1/status/":
-        return jsonify({"status": "OK"})
-
-    if not auth.require_auth(request.path, excluded_paths):
+    if not auth.require_auth(request.path, EXCLUDED_PATHS):
         return
 
     if (
@@ -70,10 +74,11 @@ def handle_auth():
     ):
         abort(401)
 
-    if auth.current_user(request) is None:
+    current_user = auth.current_user(request)
+    if current_user is None:
         abort(403)
 
-    request.current_user = auth.current_user(request)
+    request.current_user = current_user
 
 
 @app.errorhandler(404)
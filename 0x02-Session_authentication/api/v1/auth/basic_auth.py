@@ -7,6 +7,12 @@ Define BasicAuth class that inherits from Auth.
 
 from .auth import Auth
 import base64
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
 from typing import TypeVar
 from models.user import User
 
@@ -16,6 +22,14 @@ class BasicAuth(Auth):
     Inherit from Auth.
     """
 
+    # Keyed digest of the Authorization header ->
+    # (user id, email, password hash, expiry)
+    credentials_cache = OrderedDict()
+    cache_size = int(getenv("AUTH_CACHE_SIZE", "10000"))
+    cache_ttl = int(getenv("AUTH_CACHE_TTL", "300"))
+    _cache_key = secrets.token_bytes(32)
+    _cache_lock = threading.Lock()
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """
@@ -95,6 +109,39 @@ class BasicAuth(Auth):
 
         return None
 
+    def cached_user(self, digest: bytes) -> TypeVar("User"):
+        """
+        Returns the User cached for an Authorization header digest,
+        or None if it expired or the user changed since it was cached.
+        """
+        with self._cache_lock:
+            entry = self.credentials_cache.get(digest)
+            if entry is None:
+                return None
+            self.credentials_cache.move_to_end(digest)
+
+        user_id, email, password, expires_at = entry
+        user = None
+        if expires_at > time.monotonic():
+            user = User.get(user_id)
+        if user is None or user.email != email or user.password != password:
+            with self._cache_lock:
+                self.credentials_cache.pop(digest, None)
+            return None
+        return user
+
+    def cache_user(self, digest: bytes, user: TypeVar("User")):
+        """
+        Remembers the User an Authorization header digest resolved to.
+        """
+        entry = (user.id, user.email, user.password,
+                 time.monotonic() + self.cache_ttl)
+        with self._cache_lock:
+            self.credentials_cache[digest] = entry
+            self.credentials_cache.move_to_end(digest)
+            while len(self.credentials_cache) > self.cache_size:
+                self.credentials_cache.popitem(last=False)
+
     def current_user(self, request=None) -> TypeVar("User"):
         """
         Overloads Auth and retrieves the User instance for a request.
@@ -104,6 +151,26 @@ class BasicAuth(Auth):
         if not auth_header:
             return None
 
+        # Resolved once per request
+        if getattr(request, "basic_auth_header", None) == auth_header:
+            return request.basic_auth_user
+
+        digest = hmac.digest(self._cache_key, auth_header.encode(), "sha256")
+        user = self.cached_user(digest)
+        if user is None:
+            user = self.user_from_authorization_header(auth_header)
+            if user is not None:
+                self.cache_user(digest, user)
+
+        request.basic_auth_header = auth_header
+        request.basic_auth_user = user
+        return user
+
+    def user_from_authorization_header(
+            self, auth_header: str) -> TypeVar("User"):
+        """
+        Retrieves the User instance from the Authorization header value.
+        """
         encoded = self.extract_base64_authorization_header(auth_header)
 
         decoded = self.decode_base64_authorization_header(encoded)
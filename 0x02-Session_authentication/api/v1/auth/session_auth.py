@@ -6,7 +6,127 @@ Define SessionAuth class that inherits from Auth.
 
 
 from .auth import Auth
+import threading
+import time
 import uuid
+from collections import OrderedDict, deque
+from os import getenv
+from typing import TypeVar
+from models.user import User
+
+
+class SessionStore:
+    """
+    Bounded map of session ID -> user ID.
+
+    Sessions expire duration seconds after creation (never if duration
+    is 0) and the least recently used one is evicted once the store
+    holds capacity sessions.
+    """
+
+    def __init__(self, duration: int = 0, capacity: int = 100000):
+        """
+        Initialize an empty store.
+        """
+        self.duration = duration
+        self.capacity = capacity
+        # session ID -> (user ID, expiry), least recently used first
+        self.sessions = OrderedDict()
+        # (expiry, session ID) in creation order, which is also expiry
+        # order since every session lives for the same duration
+        self.expiries = deque()
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def sweep(self, now: float):
+        """
+        Drop the sessions that expired before now.
+        """
+        while len(self.expiries) > 0 and self.expiries[0][0] <= now:
+            expires_at, session_id = self.expiries.popleft()
+            entry = self.sessions.get(session_id)
+            # Entries of evicted or re-created sessions are stale
+            if entry is not None and entry[1] == expires_at:
+                del self.sessions[session_id]
+                self.expired += 1
+
+    def compact(self):
+        """
+        Drop the expiries of evicted, removed or re-created sessions,
+        which sweep() would only reach once they expire.
+        """
+        self.expiries = deque(
+            (expires_at, session_id)
+            for expires_at, session_id in self.expiries
+            if self.sessions.get(session_id, (None, None))[1] == expires_at
+        )
+
+    def __setitem__(self, session_id: str, user_id: str):
+        """
+        Store a new session for user_id.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.sweep(now)
+            expires_at = None
+            if self.duration > 0:
+                expires_at = now + self.duration
+                self.expiries.append((expires_at, session_id))
+            self.sessions[session_id] = (user_id, expires_at)
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.capacity:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            # Keeps expiries O(capacity) at O(1) amortized per session
+            if len(self.expiries) > 2 * self.capacity:
+                self.compact()
+
+    def get(self, session_id: str, default: str = None) -> str:
+        """
+        Return the user ID of a live session, or default.
+        """
+        with self.lock:
+            self.sweep(time.monotonic())
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return default
+            self.sessions.move_to_end(session_id)
+            return entry[0]
+
+    def pop(self, session_id: str, default: str = None) -> str:
+        """
+        Remove a session and return its user ID, or default.
+        """
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        """
+        Whether session_id is a live session.
+        """
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        """
+        Number of live sessions.
+        """
+        with self.lock:
+            self.sweep(time.monotonic())
+            return len(self.sessions)
+
+    def stats(self) -> dict:
+        """
+        Counters of live, expired and evicted sessions.
+        """
+        return {
+            "live": len(self),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
 
 
 class SessionAuth(Auth):
@@ -14,7 +134,10 @@ class SessionAuth(Auth):
     Inherit from Auth.
     """
 
-    user_id_by_session_id = {}
+    user_id_by_session_id = SessionStore(
+        int(getenv("SESSION_DURATION", "0")),
+        int(getenv("SESSION_CAPACITY", "100000")),
+    )
 
     def create_session(self, user_id: str = None) -> str:
         """
@@ -35,3 +158,12 @@ class SessionAuth(Auth):
             return None
 
         return self.user_id_by_session_id.get(session_id)
+
+    def current_user(self, request=None) -> TypeVar("User"):
+        """
+        Overloads Auth and retrieves the User of the session cookie.
+        """
+        user_id = self.user_id_for_session_id(self.session_cookie(request))
+        if user_id is None:
+            return None
+        return User.get(user_id)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Define SessionDBAuth class that inherits from SessionAuth.
+"""
+
+
+from .session_auth import SessionAuth, SessionStore
+import sqlite3
+import threading
+import time
+import uuid
+from os import getenv
+
+
+class SessionDBAuth(SessionAuth):
+    """
+    Inherit from SessionAuth and keep sessions in a SQLite file,
+    so they survive restarts and are shared between workers.
+    """
+
+    db_path = getenv("SESSION_DB_PATH", ".db_sessions.sqlite3")
+    session_duration = int(getenv("SESSION_DURATION", "0"))
+    # Read-through cache in front of the database
+    cache_ttl = int(getenv("SESSION_CACHE_TTL", "5"))
+    user_id_by_session_id = SessionStore(
+        cache_ttl, int(getenv("SESSION_CAPACITY", "100000"))
+    )
+    purge_interval = 60
+    purge_batch_size = 1000
+    _next_purge = 0
+    _local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Return the SQLite connection of the current thread.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " user_id TEXT NOT NULL,"
+                " expires_at REAL"
+                ") WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_expires_at"
+                " ON sessions (expires_at)"
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def cacheable(self, expires_at: float, now: float) -> bool:
+        """
+        Whether a session stays valid for as long as the cache keeps it,
+        never if the cache is off (SESSION_CACHE_TTL=0).
+        """
+        if self.cache_ttl <= 0:
+            return False
+        return expires_at is None or expires_at - now > self.cache_ttl
+
+    def create_session(self, user_id: str = None) -> str:
+        """
+        Create a session id for user id and store it in the database.
+        """
+        if user_id is None or not isinstance(user_id, str):
+            return None
+
+        now = time.time()
+        expires_at = None
+        if self.session_duration > 0:
+            expires_at = now + self.session_duration
+
+        session_id = str(uuid.uuid4())
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, user_id, expires_at)"
+                " VALUES (?, ?, ?)",
+                (session_id, user_id, expires_at),
+            )
+        if self.cacheable(expires_at, now):
+            self.user_id_by_session_id[session_id] = user_id
+
+        if now >= SessionDBAuth._next_purge:
+            SessionDBAuth._next_purge = now + self.purge_interval
+            self.purge_expired(now)
+        return session_id
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """
+        Return the User ID based on a Session ID, reading through
+        the cache.
+        """
+        if session_id is None or not isinstance(session_id, str):
+            return None
+
+        if self.cache_ttl > 0:
+            user_id = self.user_id_by_session_id.get(session_id)
+            if user_id is not None:
+                return user_id
+
+        now = time.time()
+        row = self.connection().execute(
+            "SELECT user_id, expires_at FROM sessions"
+            " WHERE session_id = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (session_id, now),
+        ).fetchone()
+        if row is None:
+            return None
+
+        user_id, expires_at = row
+        if self.cacheable(expires_at, now):
+            self.user_id_by_session_id[session_id] = user_id
+        return user_id
+
+    def purge_expired(self, now: float = None) -> int:
+        """
+        Delete expired sessions, one short transaction per batch,
+        and return how many were deleted.
+        """
+        if now is None:
+            now = time.time()
+
+        conn = self.connection()
+        deleted = 0
+        while True:
+            with conn:
+                count = conn.execute(
+                    "DELETE FROM sessions WHERE session_id IN ("
+                    " SELECT session_id FROM sessions"
+                    " WHERE expires_at <= ? LIMIT ?)",
+                    (now, self.purge_batch_size),
+                ).rowcount
+            deleted += count
+            if count < self.purge_batch_size:
+                return deleted
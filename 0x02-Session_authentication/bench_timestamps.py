@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Time per call in µs of parsing and formatting timestamps with
+strptime()/strftime() and with parse_timestamp()/format_timestamp(),
+and of formatting the two timestamps of a user for to_json():
+
+    ./bench_timestamps.py [calls]
+"""
+import sys
+import timeit
+from datetime import datetime
+from models.base import TIMESTAMP_FORMAT, format_timestamp, parse_timestamp
+from models.user import User
+
+
+def timed(function, calls: int, runs: int = 5) -> float:
+    """Best time per call of function in µs"""
+    return min(timeit.repeat(function, number=calls, repeat=runs)) \
+        / calls * 1000000
+
+
+def strftime(user: User) -> tuple:
+    """timestamps() with strftime()"""
+    return (user.created_at.strftime(TIMESTAMP_FORMAT),
+            user.updated_at.strftime(TIMESTAMP_FORMAT))
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    text = "2024-01-02T03:04:05"
+    value = datetime.strptime(text, TIMESTAMP_FORMAT)
+    user = User(email="user@example.com", first_name="First",
+                last_name="Last", created_at=text, updated_at=text)
+
+    rows = (
+        ("strptime / parse_timestamp",
+         lambda: datetime.strptime(text, TIMESTAMP_FORMAT),
+         lambda: parse_timestamp(text)),
+        ("strftime / format_timestamp",
+         lambda: value.strftime(TIMESTAMP_FORMAT),
+         lambda: format_timestamp(value)),
+        ("strftime / timestamps()",
+         lambda: strftime(user),
+         lambda: user.timestamps()),
+    )
+    print("{:<30} {:>8} {:>8}".format("", "µs", "µs"))
+    for name, before, after in rows:
+        print("{:<30} {:>8.2f} {:>8.2f}".format(
+            name, timed(before, calls), timed(after, calls)))
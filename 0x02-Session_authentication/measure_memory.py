@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Bytes per user of loaded User objects, with their attributes in
+__slots__ (the current layout) and in a __dict__ (the layout before
+them), and of User objects once serialized by to_json() as listings
+do, measured with tracemalloc:
+
+    ./measure_memory.py [counts...]
+
+Users are built from generated records like load_from_file() builds
+them: 64 hex digit password hash, about 18 character email
+"""
+import sys
+import tracemalloc
+from models.base import JSON_CACHE
+from models.user import User
+
+
+class DictUser:
+    """Same attributes as User, kept in a __dict__"""
+
+
+def records(count: int):
+    """count JSON records of users"""
+    for i in range(count):
+        yield {
+            "id": "{:08x}-0000-4000-8000-{:012x}".format(i, i),
+            "email": "user{}@example.com".format(i),
+            "_password": "{:064x}".format(i),
+            "first_name": "First{}".format(i),
+            "last_name": "Last",
+            "created_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-01T00:00:00",
+        }
+
+
+def slots(record: dict) -> User:
+    """User of record"""
+    return User(**record)
+
+
+def dicts(record: dict) -> DictUser:
+    """DictUser with the attributes the User of record would have"""
+    user = User(**record)
+    obj = DictUser()
+    for field in User.fields():
+        setattr(obj, field, getattr(user, field))
+    return obj
+
+
+def serialized(record: dict) -> User:
+    """User of record, after one to_json() and to_json_bytes()"""
+    user = User(**record)
+    user.to_json()
+    user.to_json_bytes()
+    return user
+
+
+def bytes_per_user(build, count: int) -> int:
+    """Memory held by count objects built with build, per object"""
+    JSON_CACHE.clear()
+    tracemalloc.start()
+    objs = {}
+    for record in records(count):
+        obj = build(record)
+        objs[obj.id] = obj
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current // count
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    print("{:>8} {:>12} {:>12} {:>14}".format(
+        "users", "__dict__ B", "__slots__ B", "serialized B"))
+    for count in counts:
+        print("{:>8} {:>12} {:>12} {:>14}".format(
+            count, bytes_per_user(dicts, count),
+            bytes_per_user(slots, count), bytes_per_user(serialized, count)))
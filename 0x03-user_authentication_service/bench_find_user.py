@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+Time DB.find_user_by() lookups on each column it is called with,
+with the indexes of the users table and without them:
+
+    ./bench_find_user.py [rows] [lookups]
+
+Works on a.db in a temporary directory, filled with generated users.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+from db import DB
+from user import User
+
+
+def fill(db: DB, count: int) -> List[dict]:
+    """
+    Insert count users in batches and return their rows.
+    """
+    rows = [
+        {
+            "email": "user{}@example.com".format(i),
+            "hashed_password": "hash{}".format(i),
+            "session_id": "session-{}".format(i),
+            "reset_token": "token-{}".format(i),
+        }
+        for i in range(count)
+    ]
+    with db._engine.begin() as connection:
+        for start in range(0, count, 100000):
+            connection.execute(
+                User.__table__.insert(), rows[start:start + 100000])
+    return rows
+
+
+def lookup_times(db: DB, rows: List[dict], lookups: int) -> dict:
+    """
+    Mean time in ms of find_user_by() on each indexed column.
+    """
+    times = {}
+    for column in ("email", "session_id", "reset_token"):
+        sample = random.sample(rows, lookups)
+        start = time.perf_counter()
+        for row in sample:
+            db.find_user_by(**{column: row[column]})
+        times[column] = (time.perf_counter() - start) / lookups * 1000
+    return times
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        db = DB()
+        start = time.perf_counter()
+        rows = fill(db, count)
+        print("{} users inserted in {:.1f}s".format(
+            count, time.perf_counter() - start))
+
+        indexed = lookup_times(db, rows, lookups)
+        for index in User.__table__.indexes:
+            index.drop(db._engine)
+        scanned = lookup_times(db, rows, lookups)
+
+        print("{:<12} {:>14} {:>14}".format(
+            "column", "no index ms", "indexed ms"))
+        for column in indexed:
+            print("{:<12} {:>14.3f} {:>14.3f}".format(
+                column, scanned[column], indexed[column]))